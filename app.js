@@ -1,23 +1,60 @@
 const { chromium } = require('playwright');
 
+// Streamed capture protocol: one JSON record per line on stdout
+//   {"type": "meta", "title": ..., "url": ..., "capture": "html" | "text"}
+//   {"type": "jsonld", "data": [...]}       (text capture only, raw JSON-LD blocks of the page)
+//   {"type": "chunk", "data": ...}          (repeated, the page content in order)
+//   {"type": "end", "bytes": ..., "truncated": ...}
+//   {"type": "error", "message": ...}
+const CHUNK_SIZE = 64 * 1024;
+
+function write(record) {
+  const line = JSON.stringify(record) + '\n';
+  return new Promise(resolve => {
+    if (process.stdout.write(line)) resolve();
+    else process.stdout.once('drain', resolve);
+  });
+}
+
 (async () => {
 
   const url = process.argv[2];
+  const timeout = parseInt(process.argv[3] || '30000');
+  const maxBytes = parseInt(process.argv[4] || String(2 * 1024 * 1024));
+  const capture = process.argv[5] || 'html';
   const browser = await chromium.launch();
   const page = await browser.newPage();
 
   try {
-    await page.goto(url);
-    let title = await page.title();
-    let body = await page.$eval('body', el => el.innerHTML);  //innerText
-    title = title.replace(/"/g, "'");
-    body = body.replace(/"/g, "'");
-    const result = { title, body };
-    console.log(JSON.stringify(result));
+    await page.goto(url, { timeout });
+    const title = await page.title();
+    // cut the content inside the page, so huge pages are never copied whole (characters, bytes are checked below)
+    const content = await page.evaluate(([capture, maxChars]) => {
+      const text = capture === 'text' ? document.body.innerText : document.documentElement.outerHTML;
+      return { data: text.slice(0, maxChars), truncated: text.length > maxChars };
+    }, [capture, maxBytes]);
+    await write({ type: 'meta', title, url: page.url(), capture });
+    if (capture === 'text') {
+      const jsonld = await page.$$eval('script[type="application/ld+json"]', scripts => scripts.map(script => script.textContent));
+      await write({ type: 'jsonld', data: jsonld });
+    }
+
+    let bytes = 0;
+    let truncated = content.truncated;
+    for (let start = 0; start < content.data.length; start += CHUNK_SIZE) {
+      const data = content.data.slice(start, start + CHUNK_SIZE);
+      const size = Buffer.byteLength(data);
+      if (bytes + size > maxBytes) {
+        truncated = true;
+        break;
+      }
+      bytes += size;
+      await write({ type: 'chunk', data });
+    }
+    await write({ type: 'end', bytes, truncated });
   } catch (e) {
-    console.log(JSON.stringify({title: "ERROR", body: ""}));
+    await write({ type: 'error', message: String(e) });
   } finally {
     await browser.close();
   }
 })();
-
@@ -1,3 +1,5 @@
+import os
+import time
 from pathlib import Path
 import streamlit as st
 
@@ -8,9 +10,32 @@ load_dotenv()
 @st.cache_resource(show_spinner=False)
 def create_agent():
     from src.llm.agent import make_agent
-    from src.llm.callback_handler import StreamlitCallbackHandler
-    app_handler = StreamlitCallbackHandler()
-    return make_agent(callbacks=[app_handler]), app_handler
+    return make_agent()
+
+
+def run_remote(api_url: str, image: str, steps: int, force: bool, multi: bool, result: st.container):
+    """Run the agent on the job API service, following its progress events."""
+    from src.api.client import JobClient
+    client = JobClient(api_url)
+    pb = st.progress(0, text="Submitting job...")
+    job = client.submit_file(image, max_steps=steps, force=force, multi=multi)
+    seen = 0
+    while True:
+        response = client.events(job["id"], since=seen)
+        seen += len(response["events"])
+        for event in response["events"]:
+            text = f"[{event['step']}] {event['kind']} {event.get('name', '')}"
+            pb.progress(min(event["step"] / (steps + 1), 1.), text=text)
+        if response["status"] not in ("queued", "running"):
+            break
+        time.sleep(1)
+    pb.progress(1., text=response["status"].upper())
+    calendar = client.calendar(job["id"])
+    if calendar:
+        result.text_area("iCalendar", calendar, height=300, disabled=True)
+        result.download_button('Download iCalendar', calendar, file_name='event.ics', mime='text/calendar')
+    else:
+        result.error("No iCalendar found")
 
 
 st.set_page_config(layout='wide')
@@ -33,15 +58,29 @@ result = col1.container()
 
 with col2:
     st.header("Event Agent")
-    with st.spinner('Loading model...'):
-        agent, app_handler = create_agent()
+    api_url = os.environ.get("IMG2CALENDAR_API")
+    if not api_url:
+        with st.spinner('Loading model...'):
+            agent = create_agent()
 
     steps = st.slider('Steps', 1, 10, 6)
 
     force = st.checkbox('Force run')
+    multi = st.checkbox('Multiple events', help="split posters announcing several events (festivals, agendas ...) and research them in parallel")
+    profile = st.checkbox('Profile run', value=os.environ.get("IMG2CALENDAR_PROFILE", "").lower() in ("1", "true", "yes"),
+                          help="sample CPU and track allocations of the run (local runs only)")
 
     if st.button('Start'):
+        if api_url:
+            run_remote(api_url, image_files[selected_image], steps, force, multi, result)
+            st.stop()
         pb = st.progress(0, text="Creating event...")
         tabs = st.tabs([f"History {i+1}" for i in range(steps)])
+        # the agent is shared across sessions, callback handlers are per run
+        from src.llm.callback_handler import StreamlitCallbackHandler
+        app_handler = StreamlitCallbackHandler()
         app_handler.set_app(steps, pb, tabs, result)
-        agent.run(image_files[selected_image], steps, force)
+        if multi:
+            agent.run_multi(image_files[selected_image], steps, force, callbacks=[app_handler], profile=profile)
+        else:
+            agent.run(image_files[selected_image], steps, force, callbacks=[app_handler], profile=profile)
@@ -1,9 +1,11 @@
+import asyncio
 import html
 import io
 import json
 import os
 import tempfile
 import traceback
+from functools import lru_cache
 
 from dotenv import load_dotenv
 from loguru import logger
@@ -12,14 +14,27 @@ from telegram.constants import ParseMode
 from telegram.ext import (ApplicationBuilder, CallbackContext, CommandHandler,
                           ContextTypes, MessageHandler, Updater, filters)
 
+from src.api.client import JobClient
 from src.llm.agent import make_agent
 from src.llm.callback_handler import OutputCallbackHandler
 
 
-def process_image(image_url):
+@lru_cache(maxsize=None)
+def get_agent():
+    # one agent is shared by all updates, runs keep their own state
+    return make_agent()
+
+
+def process_image(image_url, profile=None):
     logger.info("Processing image ...")
-    agent = make_agent(callbacks=[OutputCallbackHandler()])
-    event = agent.run(image_url)
+    api_url = os.environ.get("IMG2CALENDAR_API")
+    if api_url:
+        # the agent runs on the job API service, see src/api/server.py
+        client = JobClient(api_url)
+        status = client.wait(client.submit_file(image_url)["id"])
+        event = client.calendar(status["id"]), status.get("event")
+    else:
+        event = get_agent().run(image_url, callbacks=[OutputCallbackHandler()], profile=profile)
     logger.info(event)
     return event
 
@@ -35,8 +50,10 @@ async def handle_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
         image_path = f.name
         await photo.download_to_drive(image_path)
 
-        # Process the image and generate the ICS file
-        ics_data, action = process_image(image_path)
+        # Process the image and generate the ICS file, without blocking other updates;
+        # a "profile" caption profiles the run (as IMG2CALENDAR_PROFILE=1 does for every run)
+        profile = True if "profile" in (update.message.caption or "").lower() else None
+        ics_data, action = await asyncio.to_thread(process_image, image_path, profile)
 
     # Send the ICS file to the user
     if ics_data:
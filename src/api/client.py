@@ -0,0 +1,76 @@
+"""Client of the job API, for the bot, the Streamlit app and batch processing.
+
+    python -m src.api.client [--url http://127.0.0.1:8080] [--multi] image.jpg ...
+"""
+import argparse
+import json
+import mimetypes
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+
+class JobClient:
+    def __init__(self, url: str = "http://127.0.0.1:8080", timeout: float = 30):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def _request(self, path: str, data: Optional[bytes] = None, headers: Optional[Dict[str, str]] = None) -> bytes:
+        request = Request(self.url + path, data=data, headers=headers or {}, method="POST" if data else "GET")
+        with urlopen(request, timeout=self.timeout) as response:
+            return response.read()
+
+    def submit(self, image: bytes, content_type: str = "image/jpeg", **options: Any) -> Dict[str, Any]:
+        query = urlencode({key: int(value) if isinstance(value, bool) else value for key, value in options.items()})
+        return json.loads(self._request(f"/jobs?{query}", image, {"Content-Type": content_type}))
+
+    def submit_file(self, path: str, **options: Any) -> Dict[str, Any]:
+        content_type = mimetypes.guess_type(path)[0] or "image/jpeg"
+        return self.submit(Path(path).read_bytes(), content_type, **options)
+
+    def status(self, job_id: str) -> Dict[str, Any]:
+        return json.loads(self._request(f"/jobs/{job_id}"))
+
+    def events(self, job_id: str, since: int = 0) -> Dict[str, Any]:
+        return json.loads(self._request(f"/jobs/{job_id}/events?since={since}"))
+
+    def calendar(self, job_id: str) -> Optional[str]:
+        try:
+            return self._request(f"/jobs/{job_id}/calendar.ics").decode()
+        except HTTPError as ex:
+            if ex.code in (404, 409):
+                return None
+            raise
+
+    def wait(self, job_id: str, poll: float = 1., timeout: float = 600) -> Dict[str, Any]:
+        """Poll the job until it is finished; return its final status."""
+        deadline = time.monotonic() + timeout
+        while True:
+            status = self.status(job_id)
+            if status["status"] not in ("queued", "running") or time.monotonic() > deadline:
+                return status
+            time.sleep(poll)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m src.api.client", description="submit images to the job API")
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--multi", action="store_true")
+    args = parser.parse_args()
+
+    client = JobClient(args.url)
+    jobs = {image: client.submit_file(image, multi=args.multi)["id"] for image in args.images}
+    for image, job_id in jobs.items():
+        status = client.wait(job_id)
+        print(f"{image}: {status['status']} {status.get('event') or ''}")
+        calendar = client.calendar(job_id)
+        if calendar:
+            Path(image).with_suffix(".ics").write_text(calendar)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from uuid import uuid4
+
+from langchain.callbacks.base import BaseCallbackHandler
+from loguru import logger
+
+DEFAULT_JOBS_DIR = Path(Path(__file__).absolute().parent.parent.parent / "data" / "jobs")
+# finished jobs are forgotten after this many seconds
+JOB_TTL = 24 * 60 * 60
+
+
+@dataclass
+class Job:
+    id: str
+    key: str
+    image: str
+    options: Dict[str, Any]
+    status: str = "queued"
+    created: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    step: int = 0
+    events: List[Dict[str, Any]] = field(default_factory=list)
+    calendar: Optional[str] = None
+    event: Optional[str] = None
+    error: Optional[str] = None
+
+    @property
+    def active(self) -> bool:
+        return self.status in ("queued", "running")
+
+    def summary(self) -> Dict[str, Any]:
+        summary = asdict(self)
+        summary.pop("events")
+        summary.pop("image")
+        summary["last_event"] = self.events[-1] if self.events else None
+        return summary
+
+
+class JobCallbackHandler(BaseCallbackHandler):
+    """Record the progress of an agent run as events of a job."""
+
+    def __init__(self, job: Job) -> None:
+        self.job = job
+
+    def _event(self, kind: str, **kwargs: Any) -> None:
+        self.job.events.append({"ts": time.time(), "step": self.job.step, "kind": kind, **kwargs})
+
+    def on_agent_start(self, **kwargs: Any) -> None:
+        self._event("agent_start")
+
+    def on_agent_end(self, calendar: str, **kwargs: Any) -> None:
+        self._event("agent_end", calendar=calendar is not None)
+
+    def on_step(self, step: int, **kwargs: Any) -> None:
+        self.job.step = step
+        if kwargs.get("assistant_reply"):
+            command = kwargs["assistant_reply"].command
+            self._event("plan", command=command.dict() if command else None)
+        else:
+            self._event("step")
+
+    def on_usage(self, model: str, kind: str, tokens: int, seconds: float, **kwargs: Any) -> None:
+        """Run after every chain call of the agent, with its (estimated when streamed) tokens."""
+        self._event("llm_end", model=model, chain=kind, tokens=tokens, seconds=round(seconds, 2))
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, **kwargs: Any) -> Any:
+        self._event("tool_start", name=serialized["name"], input=input_str)
+
+    def on_tool_end(self, output: str, **kwargs: Any) -> Any:
+        self._event("tool_end", name=kwargs.get("name"))
+
+
+class JobManager:
+    """Run agent jobs on a worker pool; identical images share a single job."""
+
+    def __init__(self, agent_factory: Callable[[], Any], workers: int = 4, jobs_dir: Path = DEFAULT_JOBS_DIR):
+        self._agent_factory = agent_factory
+        self._agent = None
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._lock = threading.Lock()
+        self.jobs: Dict[str, Job] = {}
+        self._by_key: Dict[str, str] = {}
+        self.jobs_dir = jobs_dir
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def agent(self):
+        # the agent is loaded once and shared by all the workers
+        with self._lock:
+            if self._agent is None:
+                self._agent = self._agent_factory()
+            return self._agent
+
+    def submit(self, image: bytes, suffix: str = ".jpg", **options: Any) -> Job:
+        """Queue a job for the image, or return the active/finished job of an identical submission."""
+        key = hashlib.sha1(image).hexdigest()
+        if options.get("multi"):
+            key += "-multi"
+        with self._lock:
+            self._expire()
+            job = self.jobs.get(self._by_key.get(key, ""))
+            if job is not None and job.status != "failed" and not options.get("force"):
+                logger.info(f"Deduplicated submission of job {job.id}")
+                return job
+            job_id = uuid4().hex
+            image_path = self.jobs_dir / f"{job_id}{suffix}"
+            image_path.write_bytes(image)
+            job = Job(id=job_id, key=key, image=str(image_path), options=options)
+            self.jobs[job.id] = job
+            self._by_key[key] = job.id
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def _run(self, job: Job) -> None:
+        job.status = "running"
+        job.started = time.time()
+        try:
+            options = dict(job.options)
+            run = self.agent.run_multi if options.pop("multi", False) else self.agent.run
+            job.calendar, job.event = run(job.image, callbacks=[JobCallbackHandler(job)], **options)
+            status = "done"
+        except Exception as ex:
+            logger.exception(ex)
+            job.error = str(ex)
+            status = "failed"
+        # finished goes first, an inactive job always has it (see _expire)
+        job.finished = time.time()
+        job.status = status
+
+    def _expire(self) -> None:
+        deadline = time.time() - JOB_TTL
+        for job_id, job in list(self.jobs.items()):
+            if not job.active and job.finished is not None and job.finished < deadline:
+                del self.jobs[job_id]
+                Path(job.image).unlink(missing_ok=True)
+                if self._by_key.get(job.key) == job_id:
+                    del self._by_key[job.key]
@@ -0,0 +1,120 @@
+"""Local HTTP job API for the agent.
+
+    python -m src.api.server [--host 127.0.0.1] [--port 8080] [--workers 4]
+
+    POST /jobs?multi=1&max_steps=6&force=1   body: image bytes      -> 202 {"id": ..., "status": ...}
+    GET  /jobs/<id>                                                   -> job status
+    GET  /jobs/<id>/events?since=N                                    -> progress events
+    GET  /jobs/<id>/calendar.ics                                      -> iCalendar
+"""
+import argparse
+import json
+import mimetypes
+import re
+import unicodedata
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+from urllib.parse import parse_qs, quote, urlparse
+
+from dotenv import load_dotenv
+from loguru import logger
+
+from src.api.jobs import JobManager
+
+MAX_UPLOAD_BYTES = 20 * 1024 * 1024
+JOB_PATH = re.compile(r"^/jobs/(?P<id>[0-9a-f]+)(?P<resource>/events|/calendar\.ics)?$")
+UNSAFE_FILENAME = re.compile(r"[^\w.\- ]+", re.ASCII)
+
+
+def content_disposition(filename: str) -> str:
+    """Attachment header with an ASCII fallback name and the UTF-8 name (RFC 6266 / 5987)."""
+    ascii_name = unicodedata.normalize("NFKD", filename).encode("ascii", "ignore").decode()
+    ascii_name = " ".join(UNSAFE_FILENAME.sub("_", ascii_name).split()).strip("_")
+    if not ascii_name or ascii_name.startswith("."):
+        ascii_name = "event" + ascii_name
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+
+def non_negative_int(value: str) -> int:
+    number = int(value)
+    if number < 0:
+        raise ValueError(f"{value} is negative")
+    return number
+
+
+def make_handler(manager: JobManager):
+    class JobRequestHandler(BaseHTTPRequestHandler):
+        def _send(self, status: int, body: Any, content_type: str = "application/json",
+                  filename: Optional[str] = None) -> None:
+            data = (json.dumps(body) if content_type == "application/json" else body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            if filename:
+                self.send_header("Content-Disposition", content_disposition(filename))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path != "/jobs":
+                return self._send(404, {"error": "not found"})
+            length = int(self.headers.get("Content-Length", 0))
+            if length == 0 or length > MAX_UPLOAD_BYTES:
+                return self._send(413 if length else 400, {"error": f"image must be between 1 and {MAX_UPLOAD_BYTES} bytes"})
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            options = {}
+            if query.get("multi") in ("1", "true"):
+                options["multi"] = True
+            if query.get("force") in ("1", "true"):
+                options["force"] = True
+            if "max_steps" in query:
+                try:
+                    options["max_steps"] = non_negative_int(query["max_steps"])
+                except ValueError:
+                    return self._send(400, {"error": "max_steps must be a non-negative integer"})
+            suffix = mimetypes.guess_extension(self.headers.get("Content-Type", "")) or ".jpg"
+            job = manager.submit(self.rfile.read(length), suffix, **options)
+            self._send(202, job.summary())
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            match = JOB_PATH.match(url.path)
+            job = manager.get(match["id"]) if match else None
+            if job is None:
+                return self._send(404, {"error": "job not found"})
+            if match["resource"] is None:
+                return self._send(200, job.summary())
+            if match["resource"] == "/events":
+                try:
+                    since = non_negative_int(parse_qs(url.query).get("since", ["0"])[-1])
+                except ValueError:
+                    return self._send(400, {"error": "since must be a non-negative integer"})
+                return self._send(200, {"status": job.status, "events": job.events[since:]})
+            if job.calendar is None:
+                return self._send(404 if not job.active else 409, {"error": "no calendar", "status": job.status})
+            self._send(200, job.calendar, content_type="text/calendar", filename=f"{job.event or 'event'}.ics")
+
+        def log_message(self, format: str, *args: Any) -> None:
+            logger.info(format % args)
+
+    return JobRequestHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m src.api.server", description="img2calendar job API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    load_dotenv()
+    from src.llm.agent import make_agent
+    manager = JobManager(make_agent, workers=args.workers)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(manager))
+    logger.info(f"Serving jobs on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,9 @@
+from src.cache.keys import FuzzyIndex, canonical_arguments, normalize_text
+from src.cache.namespaces import (BACKENDS, NAMESPACES, Namespace, get_fuzzy_index, get_namespace, get_policy, purge,
+                                  register_backend, register_namespace)
+from src.cache.redis_store import NearCache, RedisStore
+from src.cache.store import DEFAULT_CACHE, CacheStore, NdjsonStore, decode, encode
+
+__all__ = ["BACKENDS", "DEFAULT_CACHE", "NAMESPACES", "CacheStore", "FuzzyIndex", "Namespace", "NearCache", "NdjsonStore",
+           "RedisStore", "canonical_arguments", "decode", "encode", "get_fuzzy_index", "get_namespace", "get_policy",
+           "normalize_text", "purge", "register_backend", "register_namespace"]
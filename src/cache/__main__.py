@@ -0,0 +1,91 @@
+"""Offline maintenance of the tool cache namespaces.
+
+    python -m src.cache stats [NAMESPACE ...]
+    python -m src.cache list NAMESPACE
+    python -m src.cache compact [NAMESPACE ...] [--max-bytes N]   (also the agent checkpoints, as `checkpoints`)
+    python -m src.cache purge NAMESPACE [--domain example.com]
+    python -m src.cache migrate [--cache-file data/cache.ndjson]
+"""
+import argparse
+import hashlib
+import json
+from datetime import datetime as dt
+from pathlib import Path
+
+from src.cache.keys import canonical_arguments
+from src.cache.namespaces import NAMESPACES, get_namespace, get_policy, purge
+from src.cache.store import DEFAULT_CACHE
+
+# tools cached by a single argument, whose old keys can be rebuilt
+# (whereis and geocode now cache the raw responses under other keys, their old entries are dropped)
+SINGLE_ARGUMENT = ["ocr", "google", "playwright"]
+# not a namespace: the checkpoints of the agent runs, compacted together with the namespaces
+CHECKPOINTS = "checkpoints"
+
+
+def _migrate(cache_file: Path) -> dict:
+    """Move the records of a flat cache file into their namespaces (given by the key prefix).
+
+    Keys of single argument tools are rebuilt with the canonical encoding; the
+    old '-' joined arguments of other tools are ambiguous, so they are dropped.
+    """
+    moved = {}
+    with open(cache_file) as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            name, _, argument = str(record.get("arguments", "")).partition("-")
+            key, arguments = record["key"], record["arguments"]
+            if name in SINGLE_ARGUMENT:
+                # old playwright values hold the whole text of the page
+                values = [argument, False, "html"] if name == "playwright" else [argument]
+                arguments = canonical_arguments(name, values, get_policy(name).normalize)
+                key = hashlib.sha1(arguments.encode()).hexdigest()
+            elif name != "agent":
+                continue
+            get_namespace(name).set(key, arguments, record["value"])
+            moved[name] = moved.get(name, 0) + 1
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m src.cache", description="tool cache maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    stats_parser = subparsers.add_parser("stats", help="size and age of the namespaces")
+    stats_parser.add_argument("namespaces", nargs="*")
+    list_parser = subparsers.add_parser("list", help="list the entries of a namespace")
+    list_parser.add_argument("namespace")
+    compact_parser = subparsers.add_parser("compact", help="drop duplicated, expired and least recently used entries")
+    compact_parser.add_argument("namespaces", nargs="*")
+    compact_parser.add_argument("--max-bytes", type=int, default=None)
+    purge_parser = subparsers.add_parser("purge", help="remove all the entries of a namespace, or those of a domain")
+    purge_parser.add_argument("namespace")
+    purge_parser.add_argument("--domain", default=None)
+    migrate_parser = subparsers.add_parser("migrate", help="split a flat cache file into namespaces")
+    migrate_parser.add_argument("--cache-file", type=Path, default=DEFAULT_CACHE)
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        result = {name: get_namespace(name).stats() for name in args.namespaces or NAMESPACES}
+    elif args.command == "list":
+        for entry in get_namespace(args.namespace).entries():
+            ts = dt.fromtimestamp(entry["ts"]).isoformat(timespec="seconds") if entry["ts"] else "-"
+            print(f"{entry['key']}  {ts}  {entry['bytes']:>8}  {entry['arguments']}")
+        return
+    elif args.command == "compact":
+        names = args.namespaces or list(NAMESPACES) + [CHECKPOINTS]
+        result = {name: get_namespace(name).compact(max_bytes=args.max_bytes) for name in names if name != CHECKPOINTS}
+        if CHECKPOINTS in names:
+            from src.llm.checkpoint import CheckpointStore
+            result[CHECKPOINTS] = CheckpointStore().compact()
+    elif args.command == "purge":
+        result = {args.namespace: purge(args.namespace, args.domain)}
+    else:
+        result = _migrate(args.cache_file)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
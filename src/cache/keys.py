@@ -0,0 +1,94 @@
+import json
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Set
+
+PUNCTUATION = re.compile(r"[^\w\s]", re.UNICODE)
+WHITESPACE = re.compile(r"\s+")
+URL = re.compile(r"^(https?|file)://", re.IGNORECASE)
+# ignored when comparing queries: two queries may only differ in these (numbers, places, dates, acts ... never do)
+STOPWORDS = frozenset("""
+    a al con de del el en la las lo los para por que un una y
+    a an and at for in is of on the to where
+""".split())
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase, remove accents and punctuation and collapse whitespace."""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    text = PUNCTUATION.sub(" ", text.lower())
+    return WHITESPACE.sub(" ", text).strip()
+
+
+def canonical_arguments(func_name: str, values: Iterable[Any], normalize: bool = False) -> str:
+    """Unambiguous encoding of a call, e.g. '["google", "sala apolo barcelona"]'.
+
+    With `normalize`, text arguments are normalized so that trivially different
+    queries share their key; urls are kept as they are.
+    """
+    parts: List[Any] = [func_name]
+    for value in values:
+        if isinstance(value, str) and normalize and not URL.match(value):
+            value = normalize_text(value)
+        elif not isinstance(value, (str, int, float, bool, type(None))):
+            value = str(value)
+        parts.append(value)
+    return json.dumps(parts, ensure_ascii=False)
+
+
+def argument_tokens(arguments: str) -> Optional[FrozenSet[str]]:
+    """Tokens of the text arguments of a canonical encoding, stopwords excluded (None for other encodings)."""
+    try:
+        parts = json.loads(arguments)
+    except (json.JSONDecodeError, TypeError):
+        return None
+    if not isinstance(parts, list):
+        return None
+    return frozenset(token for part in parts[1:] if isinstance(part, str) for token in normalize_text(part).split()
+                     if token not in STOPWORDS)
+
+
+class FuzzyIndex:
+    """Inverted index of the argument tokens of a namespace, to find near-duplicate queries.
+
+    Stopwords are left out of the token sets, so a query that only adds or drops
+    stopwords ("sala apolo en barcelona") matches. Two queries are close enough
+    when the Jaccard similarity of their token sets reaches `threshold` and they
+    share all their tokens: a long query differing in the city, the date or the
+    act is a different query, however similar.
+    """
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self._tokens: Dict[str, FrozenSet[str]] = {}
+        self._postings: Dict[str, Set[str]] = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def add(self, key: str, arguments: str) -> None:
+        tokens = argument_tokens(arguments)
+        if not tokens:
+            return
+        with self._lock:
+            self._tokens[key] = tokens
+            for token in tokens:
+                self._postings[token].add(key)
+
+    def lookup(self, arguments: str) -> Optional[str]:
+        """Key of the most similar indexed query, if it is similar enough."""
+        tokens = argument_tokens(arguments)
+        if not tokens:
+            return None
+        with self._lock:
+            candidates = set().union(*(self._postings.get(token, set()) for token in tokens))
+            best_key, best_score = None, 0.
+            for key in candidates:
+                other = self._tokens[key]
+                if tokens ^ other:
+                    continue
+                score = len(tokens & other) / len(tokens | other)
+                if score > best_score:
+                    best_key, best_score = key, score
+        return best_key if best_score >= self.threshold else None
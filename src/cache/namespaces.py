@@ -0,0 +1,143 @@
+import os
+import re
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Optional
+from urllib.parse import urlparse
+
+from loguru import logger
+
+from src.cache.keys import FuzzyIndex
+from src.cache.redis_store import RedisStore
+from src.cache.store import DEFAULT_MAX_BYTES, CacheStore, NdjsonStore
+
+DEFAULT_CACHE_DIR = Path(Path(__file__).absolute().parent.parent.parent / "data" / "cache")
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+URL_PATTERN = re.compile(r"https?://[^\s\"',]+")
+# e.g. CACHE_URL=redis://cache:6379/0 shares the cache between replicas
+CACHE_URL_ENV = "CACHE_URL"
+
+
+@dataclass
+class Namespace:
+    """Cache policy of a group of cached values (usually a tool)."""
+    name: str
+    ttl: Optional[float] = None
+    max_bytes: Optional[int] = DEFAULT_MAX_BYTES
+    cache_file: Optional[Path] = None
+    # normalize case, accents, punctuation and whitespace of text arguments in the keys
+    normalize: bool = False
+    # reuse the value of a previous query whose token-set similarity reaches this threshold (and differs in stopwords only)
+    similarity: Optional[float] = None
+
+    @property
+    def path(self) -> Path:
+        # e.g. CACHE_OCR_PATH=/mnt/fast/ocr.ndjson moves the ocr namespace to faster storage
+        env_path = os.environ.get(f"CACHE_{self.name.upper()}_PATH")
+        if env_path:
+            return Path(env_path)
+        return self.cache_file or DEFAULT_CACHE_DIR / f"{self.name}.ndjson"
+
+
+NAMESPACES: Dict[str, Namespace] = {
+    namespace.name: namespace for namespace in [
+        # the text of an image never changes
+        Namespace("ocr", ttl=None, max_bytes=64 * 1024 * 1024),
+        Namespace("agent", ttl=None, max_bytes=64 * 1024 * 1024),
+        Namespace("geocode", ttl=90 * DAY, max_bytes=16 * 1024 * 1024, normalize=True),
+        Namespace("whereis", ttl=30 * DAY, max_bytes=16 * 1024 * 1024, normalize=True, similarity=0.85),
+        # search results and event pages go stale quickly
+        Namespace("google", ttl=3 * DAY, max_bytes=32 * 1024 * 1024, normalize=True, similarity=0.8),
+        Namespace("playwright", ttl=2 * DAY, max_bytes=256 * 1024 * 1024),
+        Namespace("webpageqa", ttl=2 * DAY, max_bytes=32 * 1024 * 1024),
+        # main content selector of each site, sites are redesigned from time to time
+        Namespace("extraction_rules", ttl=30 * DAY, max_bytes=4 * 1024 * 1024),
+    ]
+}
+
+# shared backends by url scheme: factory(namespace, url, local store)
+BACKENDS: Dict[str, Callable[["Namespace", str, NdjsonStore], CacheStore]] = {
+    "redis": lambda namespace, url, local: RedisStore(namespace.name, url, local, ttl=namespace.ttl),
+    "rediss": lambda namespace, url, local: RedisStore(namespace.name, url, local, ttl=namespace.ttl),
+    "unix": lambda namespace, url, local: RedisStore(namespace.name, url, local, ttl=namespace.ttl),
+}
+
+_STORES: Dict[str, CacheStore] = {}
+_INDEXES: Dict[str, FuzzyIndex] = {}
+_STORES_LOCK = threading.Lock()
+
+
+def register_backend(scheme: str, factory: Callable[[Namespace, str, NdjsonStore], CacheStore]) -> None:
+    """Add a shared backend for urls of `scheme`; must be called before the namespaces are used."""
+    BACKENDS[scheme] = factory
+
+
+def _make_store(namespace: Namespace) -> CacheStore:
+    local = NdjsonStore(namespace.path, max_bytes=namespace.max_bytes, ttl=namespace.ttl)
+    url = os.environ.get(CACHE_URL_ENV)
+    if not url:
+        return local
+    scheme = urlparse(url).scheme
+    if scheme not in BACKENDS:
+        raise ValueError(f"Unknown cache backend: {scheme}")
+    try:
+        return BACKENDS[scheme](namespace, url, local)
+    except ImportError as ex:
+        logger.warning(f"{ex}, using local cache for {namespace.name}")
+        return local
+
+
+def register_namespace(namespace: Namespace) -> None:
+    """Add or replace a namespace; must be called before the namespace is used."""
+    with _STORES_LOCK:
+        NAMESPACES[namespace.name] = namespace
+        _STORES.pop(namespace.name, None)
+        _INDEXES.pop(namespace.name, None)
+
+
+def get_policy(name: str) -> Namespace:
+    with _STORES_LOCK:
+        return NAMESPACES.setdefault(name, Namespace(name))
+
+
+def get_namespace(name: str) -> CacheStore:
+    """Return the store of a namespace, unknown namespaces use the default policy."""
+    with _STORES_LOCK:
+        if name not in _STORES:
+            _STORES[name] = _make_store(NAMESPACES.setdefault(name, Namespace(name)))
+        return _STORES[name]
+
+
+def get_fuzzy_index(name: str) -> Optional[FuzzyIndex]:
+    """Near-duplicate index of a namespace, built from its entries on first use (None if disabled)."""
+    namespace = get_policy(name)
+    if namespace.similarity is None:
+        return None
+    store = get_namespace(name)
+    with _STORES_LOCK:
+        if name not in _INDEXES:
+            index = FuzzyIndex(namespace.similarity)
+            for entry in store.entries():
+                index.add(entry["key"], entry["arguments"])
+            _INDEXES[name] = index
+        return _INDEXES[name]
+
+
+def purge(name: str, domain: Optional[str] = None) -> int:
+    """Remove the entries of a namespace, or only those referring to urls of `domain` (and its subdomains)."""
+    store = get_namespace(name)
+    if domain is None:
+        return store.purge(lambda record: True)
+
+    def matches(record: Dict) -> bool:
+        for url in URL_PATTERN.findall(str(record.get("arguments", ""))):
+            host = urlparse(url).hostname or ""
+            if host == domain or host.endswith("." + domain):
+                return True
+        return False
+
+    return store.purge(matches)
@@ -0,0 +1,218 @@
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from loguru import logger
+
+from src.cache.store import CacheStore, NdjsonStore, decode, encode
+
+try:
+    import redis
+except ImportError:  # optional dependency, only needed for a shared cache
+    redis = None
+
+KEY_PREFIX = "img2calendar"
+
+# one connection pool per server, shared by all the namespaces
+_CLIENTS: Dict[str, Any] = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def get_client(url: str, socket_timeout: float = 0.5):
+    if redis is None:
+        raise ImportError("redis is required to use a shared cache (pip install redis)")
+    with _CLIENTS_LOCK:
+        if url not in _CLIENTS:
+            _CLIENTS[url] = redis.Redis.from_url(url, socket_timeout=socket_timeout, socket_connect_timeout=socket_timeout)
+        return _CLIENTS[url]
+
+
+class NearCache:
+    """Small in-process LRU of decoded values, in front of the network."""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value: Any) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisStore(CacheStore):
+    """Namespace stored in a Redis (protocol) server shared by several replicas.
+
+    Every entry is a hash with its arguments, value, codec and timestamp; the
+    namespace TTL is set as the key expiration, and the server evicts entries
+    by itself (e.g. `maxmemory-policy allkeys-lru`). Values are also written to
+    the `local` store, which answers the lookups while the server is down, and
+    recently read values are kept in a near cache.
+    """
+
+    def __init__(self, name: str, url: str, local: NdjsonStore, ttl: Optional[float] = None, pipeline: bool = True,
+                 near_entries: int = 1024, near_ttl: float = 300, retry_after: float = 30):
+        self.name = name
+        self.url = url
+        self.client = get_client(url)
+        self.local = local
+        self.ttl = ttl
+        self.pipeline = pipeline
+        self.near = NearCache(near_entries, near_ttl)
+        # seconds to wait before trying the server again once it is down
+        self.retry_after = retry_after
+        self._down_until = 0.
+
+    def _key(self, key: str) -> str:
+        return f"{KEY_PREFIX}:{self.name}:{key}"
+
+    @property
+    def available(self) -> bool:
+        return time.monotonic() >= self._down_until
+
+    def _failed(self, ex: Exception) -> None:
+        if self.available:
+            logger.warning(f"Cache server {self.url} unavailable ({ex}), using local cache for {self.retry_after}s")
+        self._down_until = time.monotonic() + self.retry_after
+
+    def get(self, key: str) -> Optional[Any]:
+        return self.get_many([key])[0]
+
+    def get_many(self, keys: List[str]) -> List[Optional[Any]]:
+        values = [self.near.get(key) for key in keys]
+        missing = [i for i, value in enumerate(values) if value is None]
+        if missing and self.available:
+            try:
+                for i, record in zip(missing, self._fetch([keys[i] for i in missing], ["value", "codec"])):
+                    if record[0] is not None:
+                        values[i] = decode(json.loads(record[0]), record[1].decode() if record[1] else None)
+            except redis.RedisError as ex:
+                self._failed(ex)
+            backfill = self.available
+            missing = [i for i in missing if values[i] is None]
+        else:
+            backfill = False
+        if missing:
+            # entries cached before the server was used (or while it was down)
+            for i, record in zip(missing, self.local.get_records([keys[i] for i in missing])):
+                if record is None:
+                    continue
+                values[i] = record["value"]
+                if backfill:
+                    # copied as it is, so it can still be purged by its arguments and expires when the local one does
+                    self._set_remote(keys[i], record["arguments"], record["value"], ts=record["ts"])
+        for key, value in zip(keys, values):
+            if value is not None:
+                self.near.set(key, value)
+        return values
+
+    def _fetch(self, keys: List[str], fields: List[str]) -> List[List[Optional[bytes]]]:
+        """HMGET `fields` of several keys, in a single round trip when pipelining."""
+        if not self.pipeline:
+            return [self.client.hmget(self._key(key), fields) for key in keys]
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.hmget(self._key(key), fields)
+        return pipe.execute()
+
+    def set(self, key: str, arguments: str, value: Any) -> None:
+        if value is None:
+            return
+        self.near.set(key, value)
+        self.local.set(key, arguments, value)
+        if self.available:
+            self._set_remote(key, arguments, value)
+
+    def _set_remote(self, key: str, arguments: Optional[str], value: Any, ts: Optional[float] = None) -> None:
+        ts = ts or time.time()
+        expire = math.ceil(self.ttl - (time.time() - ts)) if self.ttl else None
+        if expire is not None and expire <= 0:
+            return
+        encoded, codec = encode(value, self.local.compression_threshold)
+        mapping = {"value": json.dumps(encoded), "codec": codec or "", "ts": ts}
+        if arguments is not None:
+            mapping["arguments"] = arguments
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.hset(self._key(key), mapping=mapping)
+            if expire is not None:
+                pipe.expire(self._key(key), expire)
+            pipe.execute()
+        except redis.RedisError as ex:
+            self._failed(ex)
+
+    def _scan(self) -> Iterator[str]:
+        prefix = self._key("")
+        for name in self.client.scan_iter(match=prefix + "*", count=500):
+            yield name.decode()[len(prefix):]
+
+    def entries(self) -> Iterator[Dict[str, Any]]:
+        if not self.available:
+            yield from self.local.entries()
+            return
+        try:
+            keys = list(self._scan())
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                pipe = self.client.pipeline(transaction=False)
+                for key in batch:
+                    pipe.hmget(self._key(key), ["arguments", "ts", "codec"])
+                    pipe.hstrlen(self._key(key), "value")
+                results = pipe.execute()
+                for key, (arguments, ts, codec), size in zip(batch, results[::2], results[1::2]):
+                    yield {"key": key, "arguments": arguments.decode() if arguments else None,
+                           "ts": float(ts) if ts else None, "codec": codec.decode() if codec else None, "bytes": size}
+        except redis.RedisError as ex:
+            self._failed(ex)
+            yield from self.local.entries()
+
+    def compact(self, max_bytes: Optional[int] = None) -> Dict[str, int]:
+        # the server expires and evicts its entries by itself
+        return self.local.compact(max_bytes)
+
+    def purge(self, predicate: Callable[[Dict], bool]) -> int:
+        removed = self.local.purge(predicate)
+        self.near.clear()
+        if not self.available:
+            return removed
+        try:
+            matching = [entry["key"] for entry in self.entries() if predicate(entry)]
+            if matching:
+                # most entries are in both stores
+                removed = max(removed, self.client.delete(*(self._key(key) for key in matching)))
+        except redis.RedisError as ex:
+            self._failed(ex)
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {"backend": self.url, "available": self.available, "local": self.local.stats()}
+        try:
+            entries = list(self.entries()) if self.available else []
+            stats.update({"keys": len(entries), "bytes": sum(entry["bytes"] for entry in entries), "ttl": self.ttl})
+        except redis.RedisError as ex:
+            self._failed(ex)
+        return stats
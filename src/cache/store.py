@@ -0,0 +1,270 @@
+import base64
+import json
+import os
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import duckdb
+from loguru import logger
+
+try:
+    import zstandard
+except ImportError:  # optional dependency, zlib is used instead
+    zstandard = None
+
+DEFAULT_CACHE = Path(Path(__file__).absolute().parent.parent.parent / "data" / "cache.ndjson")
+# values whose json encoding is smaller than this are stored as plain json
+COMPRESSION_THRESHOLD = 4 * 1024
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# after an eviction the store is shrunk to this fraction of max_bytes
+EVICTION_TARGET = 0.8
+# the access log is collapsed to one record per key when it grows over this fraction of max_bytes (or 1MB)
+ACCESS_LOG_FRACTION = 0.05
+
+COLUMNS = "{'key': 'VARCHAR', 'arguments': 'VARCHAR', 'value': 'JSON', 'codec': 'VARCHAR', 'ts': 'DOUBLE'}"
+
+
+def encode(value: Any, threshold: int = COMPRESSION_THRESHOLD) -> Tuple[Any, Optional[str]]:
+    """Return the value to be stored and the codec used to compress it (if any)."""
+    text = json.dumps(value)
+    if len(text) < threshold:
+        return value, None
+    if zstandard is not None:
+        return base64.b64encode(zstandard.ZstdCompressor().compress(text.encode())).decode(), "zstd"
+    return base64.b64encode(zlib.compress(text.encode())).decode(), "zlib"
+
+
+def decode(value: Any, codec: Optional[str]) -> Any:
+    if codec is None:
+        return value
+    data = base64.b64decode(value)
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd compressed cache entries")
+        return json.loads(zstandard.ZstdDecompressor().decompress(data))
+    if codec == "zlib":
+        return json.loads(zlib.decompress(data))
+    raise ValueError(f"Unknown cache codec: {codec}")
+
+
+class CacheStore(ABC):
+    """Storage backend of the cached values of a namespace."""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        """Value of a key, None if missing or expired."""
+
+    def get_many(self, keys: List[str]) -> List[Optional[Any]]:
+        """Values of several keys at once (None for the missing ones); backends may batch the lookups."""
+        return [self.get(key) for key in keys]
+
+    @abstractmethod
+    def set(self, key: str, arguments: str, value: Any) -> None:
+        """Store the value of a key, with the canonical arguments it was computed from (None is not stored, it reads as missing)."""
+
+    @abstractmethod
+    def compact(self, max_bytes: Optional[int] = None) -> Dict[str, int]:
+        """Drop duplicated, expired and (over `max_bytes`) least recently used entries."""
+
+    @abstractmethod
+    def purge(self, predicate: Callable[[Dict], bool]) -> int:
+        """Remove the records for which `predicate(record)` is true; return the number of removed records."""
+
+    @abstractmethod
+    def entries(self) -> Iterator[Dict[str, Any]]:
+        """Yield key, arguments, timestamp and size of every entry."""
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        pass
+
+
+class NdjsonStore(CacheStore):
+    """Append-only ndjson key/value store queried through duckdb.
+
+    Large values are compressed, and reads are recorded in a sidecar access log
+    so that the store can be kept under `max_bytes` by evicting the least
+    recently used entries (the access log counts toward `max_bytes` too).
+    `compact` rewrites the file keeping only the latest record of every live key.
+    """
+
+    def __init__(self, cache_file: Path = DEFAULT_CACHE, max_bytes: Optional[int] = DEFAULT_MAX_BYTES,
+                 ttl: Optional[float] = None, compression_threshold: int = COMPRESSION_THRESHOLD):
+        self.cache_file = Path(cache_file)
+        self.access_file = self.cache_file.with_suffix(self.cache_file.suffix + ".access")
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.compression_threshold = compression_threshold
+        self.max_access_bytes = int(max_bytes * ACCESS_LOG_FRACTION) if max_bytes else 1024 * 1024
+        self._lock = threading.Lock()
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        self.cache_file.touch()
+
+    def get(self, key: str) -> Optional[Any]:
+        return self.get_many([key])[0]
+
+    def get_many(self, keys: List[str]) -> List[Optional[Any]]:
+        return [record["value"] if record else None for record in self.get_records(keys)]
+
+    def get_records(self, keys: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """Decoded value, arguments and timestamp of several keys (None for the missing ones)."""
+        if not keys or self.cache_file.stat().st_size == 0:
+            return [None] * len(keys)
+        select_script = f"""SELECT key, arguments, value, codec, ts
+        FROM read_ndjson('{self.cache_file}', columns={COLUMNS})
+        WHERE list_contains(?, key) AND COALESCE(ts, 0) >= ?
+        ORDER BY ts ASC NULLS FIRST
+        """
+        min_ts = time.time() - self.ttl if self.ttl else 0
+        found = {}
+        # the latest record of every key wins
+        for key, arguments, value, codec, ts in duckdb.connect().execute(select_script, [list(keys), min_ts]).fetchall():
+            # a null value (stored by older versions) reads as missing
+            if value is None:
+                found.pop(key, None)
+            else:
+                found[key] = (arguments, value, codec, ts)
+        self._touch(*found)
+        return [{"arguments": found[key][0], "value": decode(json.loads(found[key][1]), found[key][2]), "ts": found[key][3]}
+                if key in found else None for key in keys]
+
+    def set(self, key: str, arguments: str, value: Any) -> None:
+        if value is None:
+            return
+        value, codec = encode(value, self.compression_threshold)
+        record = {"key": key, "arguments": arguments, "value": value, "codec": codec, "ts": time.time()}
+        with self._lock, open(self.cache_file, "a") as file:
+            file.write(json.dumps(record) + "\n")
+        if self.max_bytes and self._size() > self.max_bytes:
+            logger.info(f"Cache {self.cache_file} exceeds {self.max_bytes} bytes, evicting entries ...")
+            self.compact(max_bytes=int(self.max_bytes * EVICTION_TARGET))
+
+    def _size(self) -> int:
+        """Bytes of the store and its access log."""
+        return self.cache_file.stat().st_size + (self.access_file.stat().st_size if self.access_file.exists() else 0)
+
+    def _touch(self, *keys: str) -> None:
+        if not keys:
+            return
+        with self._lock:
+            with open(self.access_file, "a") as file:
+                file.write("".join(json.dumps({"key": key, "ts": time.time()}) + "\n" for key in keys))
+            if self.access_file.stat().st_size > self.max_access_bytes:
+                self._write_access(self._last_access())
+
+    def _write_access(self, accessed: Dict[str, float]) -> None:
+        tmp_file = self.access_file.with_suffix(self.access_file.suffix + ".tmp")
+        with open(tmp_file, "w") as file:
+            for key, ts in accessed.items():
+                file.write(json.dumps({"key": key, "ts": ts}) + "\n")
+        os.replace(tmp_file, self.access_file)
+
+    def _last_access(self) -> Dict[str, float]:
+        accessed = {}
+        if self.access_file.exists():
+            with open(self.access_file) as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    accessed[record["key"]] = max(record["ts"], accessed.get(record["key"], 0))
+        return accessed
+
+    def _index(self) -> Iterator[Tuple[str, int, int, float]]:
+        """Yield (key, offset, length, ts) for every record in the store."""
+        offset = 0
+        with open(self.cache_file, "rb") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                    yield record["key"], offset, len(line), record.get("ts") or 0
+                except (json.JSONDecodeError, KeyError):
+                    logger.warning(f"Skipping corrupted cache record at offset {offset}")
+                offset += len(line)
+
+    def compact(self, max_bytes: Optional[int] = None) -> Dict[str, int]:
+        """Rewrite the store without duplicated, expired or least recently used entries."""
+        with self._lock:
+            latest: Dict[str, Tuple[int, int, float]] = {}
+            records = 0
+            for key, offset, length, ts in self._index():
+                records += 1
+                if key not in latest or ts >= latest[key][2]:
+                    latest[key] = (offset, length, ts)
+            min_ts = time.time() - self.ttl if self.ttl else 0
+            live = {key: entry for key, entry in latest.items() if entry[2] >= min_ts}
+
+            accessed = self._last_access()
+            kept = {}
+            size = 0
+            for key, (offset, length, ts) in sorted(live.items(), key=lambda x: max(x[1][2], accessed.get(x[0], 0)), reverse=True):
+                # the access record of the key is kept too
+                length_with_access = length + (len(json.dumps({"key": key, "ts": accessed[key]})) + 1 if key in accessed else 0)
+                if max_bytes is not None and size + length_with_access > max_bytes:
+                    break
+                kept[key] = (offset, length)
+                size += length_with_access
+
+            tmp_file = self.cache_file.with_suffix(self.cache_file.suffix + ".tmp")
+            with open(self.cache_file, "rb") as source, open(tmp_file, "wb") as target:
+                for offset, length in sorted(kept.values()):
+                    source.seek(offset)
+                    target.write(source.read(length))
+            os.replace(tmp_file, self.cache_file)
+            # keep a single access record per surviving key
+            self._write_access({key: accessed[key] for key in kept if key in accessed})
+
+        stats = {"records": records, "duplicated": records - len(latest),
+                 "expired": len(latest) - len(live), "evicted": len(live) - len(kept),
+                 "kept": len(kept), "bytes": size}
+        logger.info(f"Compacted cache {self.cache_file}: {stats}")
+        return stats
+
+    def purge(self, predicate: Callable[[Dict], bool]) -> int:
+        """Remove every record for which `predicate(record)` is true; return the number of removed records."""
+        removed = 0
+        with self._lock:
+            tmp_file = self.cache_file.with_suffix(self.cache_file.suffix + ".tmp")
+            with open(self.cache_file, "rb") as source, open(tmp_file, "wb") as target:
+                for line in source:
+                    try:
+                        if predicate(json.loads(line)):
+                            removed += 1
+                            continue
+                    except json.JSONDecodeError:
+                        pass
+                    target.write(line)
+            os.replace(tmp_file, self.cache_file)
+        logger.info(f"Purged {removed} records from {self.cache_file}")
+        return removed
+
+    def entries(self) -> Iterator[Dict[str, Any]]:
+        """Yield key, arguments, timestamp and size of every record, without decoding values."""
+        with open(self.cache_file, "rb") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                yield {"key": record["key"], "arguments": record.get("arguments"),
+                       "ts": record.get("ts"), "codec": record.get("codec"), "bytes": len(line)}
+
+    def stats(self) -> Dict[str, Any]:
+        keys = set()
+        records = expired = 0
+        min_ts = time.time() - self.ttl if self.ttl else 0
+        oldest = newest = None
+        for key, _, _, ts in self._index():
+            records += 1
+            keys.add(key)
+            expired += ts < min_ts
+            oldest = ts if oldest is None else min(oldest, ts)
+            newest = ts if newest is None else max(newest, ts)
+        return {"records": records, "keys": len(keys), "expired": expired,
+                "bytes": self._size(), "max_bytes": self.max_bytes, "ttl": self.ttl,
+                "oldest": oldest, "newest": newest}
@@ -1,6 +1,12 @@
 from __future__ import annotations
+import copy
 import hashlib
 import json
+import math
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import nullcontext
+from dataclasses import dataclass
 
 from typing import Tuple, List, Optional, Any, Dict
 
@@ -14,36 +20,115 @@ from langchain.schema import (
     SystemMessage,
 )
 from langchain.tools.base import BaseTool
+from langchain.pydantic_v1 import ValidationError
 
-from src.llm.models import Action, iCalendar, Event
-from src.utils import try_loads, retrieve_by_key, save
+from src.llm.checkpoint import CheckpointStore
+from src.llm.context import RunContext
+from src.llm.journal import RunJournal
+from src.llm.profiling import RunProfiler, current_profiler, profiling_enabled
+from src.llm.router import FAST, STRONG, ModelRouter, UsageCallbackHandler
+from src.llm.streaming import CommandStreamHandler
+from src.llm.models import Action, Command, EventCandidate, EventCandidates, iCalendar, Event
+from src.cache.namespaces import get_namespace
+from src.utils import hash_image, merge_icalendars, track_cache, try_loads
 
 from loguru import logger
 
+# default time budget (seconds) of a run
+DEFAULT_BUDGET = 300
+DEFAULT_TOOL_TIMEOUT = 60
+TOOL_TIMEOUTS = {"ocr": 60, "google": 20, "gmaps": 20, "webpageqa": 120}
+# timeout (seconds) and retries of every model request; the timeout is shortened near the deadline
+CHAIN_TIMEOUT = 60
+CHAIN_RETRIES = 1
+# time kept for the final iCalendar call (a request and its retry), and least time worth a planning call
+FINISH_RESERVE = 90
+PLANNING_ESTIMATE = 20
+# prefix of the agent cache keys of multi-event runs
+MULTI_PREFIX = "multi-"
+
+
+class ToolCallbacks(BaseCallbackHandler):
+    """Forward the events of a tool call to the handlers of the run, until the call is abandoned."""
+
+    def __init__(self, handlers: List[BaseCallbackHandler]):
+        self.handlers = handlers
+        self.muted = False
+
+    def _forward(self, event_name: str, *args: Any, **kwargs: Any) -> None:
+        if self.muted:
+            return
+        for handler in self.handlers:
+            try:
+                getattr(handler, event_name)(*args, **kwargs)
+            except Exception as ex:
+                logger.warning(f"Callback {handler} failed on {event_name}: {ex}")
+
+    def on_tool_start(self, *args: Any, **kwargs: Any) -> None:
+        self._forward("on_tool_start", *args, **kwargs)
+
+    def on_tool_end(self, *args: Any, **kwargs: Any) -> None:
+        self._forward("on_tool_end", *args, **kwargs)
+
+    def on_tool_error(self, *args: Any, **kwargs: Any) -> None:
+        self._forward("on_tool_error", *args, **kwargs)
+
+
+@dataclass
+class ToolCall:
+    """Tool call running in the executor of the agent."""
+    tool: BaseTool
+    future: Future
+    # time.time() and time.monotonic() values at submission
+    started: float
+    start: float
+    timeout: float
+    callbacks: ToolCallbacks
+
+    def abandon(self) -> None:
+        """Drop a call whose result won't be used: cancelled if still queued, and no longer reported."""
+        self.future.cancel()
+        self.callbacks.muted = True
+
+
 class img2calendar:
-    """Agent class for interacting with EventGPT."""
+    """Agent class for interacting with EventGPT.
+
+    The agent only holds immutable configuration; per-run state is kept in a
+    `RunContext`, so one instance can serve many runs in parallel threads.
+    """
 
     def __init__(
         self,
         chain: LLMChain,
         chain_icalendar: LLMChain,
         tools: List[BaseTool],
-        callbacks: Optional[List[BaseCallbackHandler]] = None
+        chain_split: Optional[LLMChain] = None,
+        chain_fast: Optional[LLMChain] = None,
+        router: Optional[ModelRouter] = None,
+        checkpoints: Optional[CheckpointStore] = None,
+        budget: Optional[float] = DEFAULT_BUDGET,
+        tool_timeouts: Optional[Dict[str, float]] = None,
+        journal: Optional[RunJournal] = None,
     ):
-        self.full_message_history: List[BaseMessage] = []
         self.chain = chain
         self.chain_icalendar = chain_icalendar
         self.tools = tools
-        self.callbacks = callbacks or []
+        self.chain_split = chain_split
+        # planning chains by deployment; without a fast chain every step uses the strong one
+        self.planners = {STRONG: chain, FAST: chain_fast or chain}
+        self.router = router or ModelRouter()
+        self.checkpoints = checkpoints or CheckpointStore()
+        self.budget = budget
+        self.tool_timeouts = {**TOOL_TIMEOUTS, **(tool_timeouts or {})}
+        self.journal = journal or RunJournal()
+        # tool calls run here so that they can be abandoned when they time out
+        self._executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="tool")
 
     @property
     def tools_template(self) -> str:
         return '\n'.join(self._generate_tools(self.tools))
 
-    @property
-    def memory_template(self) -> str:
-        return json.dumps(self.full_message_history, indent=2)
-
     @property
     def tools_dict(self) -> dict:
         return {tool.name: tool for tool in self.tools}
@@ -55,86 +140,335 @@ class img2calendar:
         tools: List[BaseTool],
         chain: LLMChain,
         chain_icalendar: LLMChain,
-        callbacks: Optional[List[BaseCallbackHandler]] = None,
+        chain_split: Optional[LLMChain] = None,
+        chain_fast: Optional[LLMChain] = None,
     ) -> img2calendar:
-        if callbacks and len(callbacks) > 0:
-            for tool in tools:
-                tool.callbacks = callbacks
         return cls(
             chain,
             chain_icalendar,
             tools,
-            callbacks=callbacks
+            chain_split=chain_split,
+            chain_fast=chain_fast,
         )
 
-    def initialize(self, image: str) -> None:
+    def initialize(self, context: RunContext) -> None:
         # bootstrap memory with the loading message
-        self.full_message_history = [{"id": 0, "name": "load_image", "result": "Image is loaded. Please state your next question?"}]
+        context.full_message_history = [{"id": 0, "name": "load_image", "result": "Image is loaded. Please state your next question?"}]
         ocr: BaseTool = self.tools_dict.get("ocr")
         if ocr  is not None:
-            self._callback_handler("on_step", step=1)
-            ocr_content = ocr.run({'url': image})
-            self.full_message_history.append({"id": 1, "name": "ocr", "result": ocr_content})
-        self.total_tokens_ = 0
-
-    def _check_agent_cache(self, ocr_content: str) -> Optional[Tuple[str, Event]]:
-        key = hashlib.sha1(ocr_content.encode()).hexdigest()
-        result = retrieve_by_key(key)
+            context.callback("on_step", step=1)
+            context.append("ocr", self._run_tool(context, ocr, {'url': context.image}))
+        context.step = 2
+        context.total_tokens = 0
+
+    def _submit_tool(self, context: RunContext, tool: BaseTool, tool_input: Dict[str, Any]) -> Optional[ToolCall]:
+        """Start a tool call, unless the time budget of the run is exhausted."""
+        timeout = min(self.tool_timeouts.get(tool.name, DEFAULT_TOOL_TIMEOUT), context.remaining() - FINISH_RESERVE)
+        if timeout <= 0:
+            return None
+        started, start = time.time(), time.monotonic()
+        callbacks = ToolCallbacks(context.callbacks)
+        future = self._executor.submit(self._tracked_run, tool, tool_input, [callbacks], current_profiler())
+        return ToolCall(tool, future, started, start, timeout, callbacks)
+
+    def _run_tool(self, context: RunContext, tool: BaseTool, tool_input: Dict[str, Any], call: Optional[ToolCall] = None) -> Any:
+        """Run a tool (or wait for a call already started) within its timeout and the time left to the run.
+
+        Timeouts and errors are returned as observations, so the agent can go
+        on with another command instead of failing the whole run.
+        """
+        call = call or self._submit_tool(context, tool, tool_input)
+        if call is None:
+            return {"error": f"{tool.name} not run, the time budget of the run is exhausted"}
+        lookups, error = [], True
+        try:
+            observation, lookups = call.future.result(timeout=max(call.timeout - (time.monotonic() - call.start), 0))
+            error = False
+            return observation
+        except FutureTimeoutError:
+            # a call still queued behind hung ones is dropped; a running one can't be interrupted
+            call.future.cancel()
+            logger.warning (f"{tool.name} timed out after {call.timeout:.0f}s")
+            return {"error": f"{tool.name} timed out after {call.timeout:.0f}s"}
+        except Exception as ex:
+            logger.error (f"{tool.name} failed: {ex}")
+            return {"error": f"{tool.name} failed: {ex}"}
+        finally:
+            # the first lookup is the one of the tool itself, the next ones those of the tools it uses
+            self.journal.record_step(context, "tool", tool.name, call.started, time.monotonic() - call.start,
+                                     cache_hit=lookups[0][1] if lookups else None, error=error)
+
+    @staticmethod
+    def _tracked_run(tool: BaseTool, tool_input: Dict[str, Any], callbacks: List[BaseCallbackHandler],
+                     profiler: Optional[RunProfiler] = None) -> Tuple[Any, List[Tuple[str, bool]]]:
+        with profiler.track(f"tool:{tool.name}") if profiler else nullcontext(), track_cache() as lookups:
+            return tool.run(tool_input, callbacks=callbacks), lookups
+
+    def _check_agent_cache(self, ocr_content: str, prefix: str = "") -> Optional[Tuple[str, str]]:
+        key = hashlib.sha1((prefix + ocr_content).encode()).hexdigest()
+        result = get_namespace("agent").get(key)
         if result:
-            result = json.loads(result)
-            return result[0], Event.parse_obj(result[1])
+            return result[0], result[1]
         return None
     
-    def _save_agent_cache(self, ocr_content: str, icalendar: str, event: str) -> None:
+    def _save_agent_cache(self, ocr_content: str, icalendar: str, event: str, prefix: str = "") -> None:
         logger.info ("Saving cache for agent ...")
-        key = hashlib.sha1(ocr_content.encode()).hexdigest()
-        save(key, "agent-"+ocr_content, [icalendar, event])
-
-    def run(self, image: str, max_steps = 10, force = False) -> Tuple[Optional[str], Optional[str]]:
-        self._callback_handler("on_agent_start", image=image)
-        self.initialize(image)
-        if not force:
-            cached_result = self._check_agent_cache(self.full_message_history[1]["result"])
+        key = hashlib.sha1((prefix + ocr_content).encode()).hexdigest()
+        get_namespace("agent").set(key, "agent-"+prefix+ocr_content, [icalendar, event])
+
+    def run(self, image: str, max_steps = 10, force = False,
+            callbacks: Optional[List[BaseCallbackHandler]] = None,
+            budget: Optional[float] = None, profile: Optional[bool] = None) -> Tuple[Optional[str], Optional[str]]:
+        """Run the agent on an image; `budget` (seconds) overrides the default time budget of the agent.
+
+        With `profile` (by default, the IMG2CALENDAR_PROFILE environment variable)
+        a CPU and memory profile of the run is saved, see `src.llm.profiling`.
+        """
+        return self._profiled(profile, image, callbacks, self._run_single, image, max_steps, force, callbacks, budget)
+
+    def _profiled(self, profile: Optional[bool], image: str, callbacks: Optional[List[BaseCallbackHandler]], run, *args: Any) -> Any:
+        if not profiling_enabled(profile):
+            return run(*args)
+        profiler = RunProfiler(hash_image(image)[:12])
+        with profiler, profiler.track("run"):
+            result = run(*args)
+        path = profiler.save()
+        for callback in callbacks or []:
+            if hasattr(callback, "on_profile"):
+                callback.on_profile(summary=profiler.summary, path=str(path))
+        return result
+
+    def _run_single(self, image: str, max_steps: int, force: bool, callbacks: Optional[List[BaseCallbackHandler]],
+                    budget: Optional[float]) -> Tuple[Optional[str], Optional[str]]:
+        context, cached_result = self._prepare(image, hash_image(image), force, callbacks, budget)
+        if cached_result:
+            return cached_result
+        try:
+            calendar = self._solve(context, max_steps)
+        except Exception:
+            self.journal.record_run(context, "single", "error")
+            raise
+        return self._finish(context, calendar)
+
+    def run_multi(self, image: str, max_steps = 6, force = False,
+                  callbacks: Optional[List[BaseCallbackHandler]] = None,
+                  budget: Optional[float] = None, max_events: int = 8,
+                  profile: Optional[bool] = None) -> Tuple[Optional[str], Optional[str]]:
+        """Run the agent on a poster announcing several events (festivals, venue agendas ...).
+
+        After OCR the poster is split into event candidates, and a sub-agent with
+        at most `max_steps` steps runs for every candidate in parallel, sharing
+        the tool caches. The calendars are merged into a single iCalendar with
+        one VEVENT per event. Sub-agents run without callbacks, since they run
+        outside the caller's thread.
+        """
+        return self._profiled(profile, image, callbacks, self._run_multi, image, max_steps, force, callbacks, budget, max_events)
+
+    def _run_multi(self, image: str, max_steps: int, force: bool, callbacks: Optional[List[BaseCallbackHandler]],
+                   budget: Optional[float], max_events: int) -> Tuple[Optional[str], Optional[str]]:
+        context, cached_result = self._prepare(image, hash_image(image) + "-multi", force, callbacks, budget, prefix=MULTI_PREFIX)
+        if cached_result:
+            return cached_result
+        try:
+            calendar = self._solve_multi(context, max_steps, max_events)
+        except Exception:
+            self.journal.record_run(context, "multi", "error")
+            raise
+        return self._finish(context, calendar, prefix=MULTI_PREFIX)
+
+    def _solve_multi(self, context: RunContext, max_steps: int, max_events: int) -> Optional[str]:
+        if self.chain_split is None or not isinstance(context.ocr_content, str):
+            return self._solve(context, max_steps)
+
+        context.callback("on_step", step=context.step)
+        try:
+            candidates: EventCandidates = self._call_chain(context, FAST, self.chain_split, kind="split", memory = context.memory_template)
+        except Exception as ex:
+            logger.error (f"Splitting the poster failed ({ex}), solving it as a single event")
+            return self._solve(context, max_steps)
+        candidates = candidates.events[:max_events]
+        logger.info (f"Found {len(candidates)} event candidates")
+        if len(candidates) <= 1:
+            return self._solve(context, max_steps)
+
+        sub_contexts = [self._sub_context(context, candidate) for candidate in candidates]
+        profiler = current_profiler()
+
+        def solve_sub(sub_context: RunContext) -> Optional[str]:
+            with profiler.track(f"event:{sub_context.event}") if profiler else nullcontext():
+                return self._solve_sub(sub_context, context.step + max_steps)
+
+        with ThreadPoolExecutor(max_workers=len(sub_contexts), thread_name_prefix="event") as executor:
+            calendars = list(executor.map(solve_sub, sub_contexts))
+
+        for sub_context in sub_contexts:
+            context.merge_usage(sub_context)
+        context.event = ", ".join(candidate.name for candidate in candidates)
+        calendar = merge_icalendars([calendar for calendar in calendars if calendar])
+        if not calendar:
+            logger.error ("No iCalendar found")
+        return calendar
+
+    def _sub_context(self, context: RunContext, candidate: EventCandidate) -> RunContext:
+        candidate_key = hashlib.sha1(candidate.json().encode()).hexdigest()[:8]
+        key = f"{context.key}-{candidate_key}"
+        sub_context = self.checkpoints.restore(key, context.image)
+        if sub_context is None:
+            sub_context = RunContext(image=context.image, key=key, step=context.step, event=candidate.name,
+                                     parent_id=context.run_id, full_message_history=copy.deepcopy(context.full_message_history))
+            sub_context.append("event_candidate", f"The poster announces several events, only gather information about this one: {candidate.json()}")
+        sub_context.parent_id = context.run_id
+        sub_context.deadline = context.deadline
+        return sub_context
+
+    def _solve_sub(self, context: RunContext, max_steps: int) -> Optional[str]:
+        try:
+            calendar = self._solve(context, max_steps)
+        except Exception as ex:
+            logger.error (f"Sub-agent for {context.event} failed: {ex}")
+            self.journal.record_run(context, "event", "error")
+            return None
+        self.checkpoints.complete(context)
+        self.journal.record_run(context, "event", "done" if calendar else "no_calendar")
+        return calendar
+
+    def _prepare(self, image: str, key: str, force: bool, callbacks: Optional[List[BaseCallbackHandler]],
+                 budget: Optional[float], prefix: str = "") -> Tuple[RunContext, Optional[Tuple[str, str]]]:
+        """Restore or initialize the context of a run; also return the cached result of the agent, if any."""
+        budget = budget or self.budget
+        deadline = time.monotonic() + budget if budget else None
+        context = self.checkpoints.restore(key, image, callbacks) if not force else None
+        if context is not None:
+            context.deadline = deadline
+            context.callback("on_agent_start", image=image)
+            logger.info (f"Resuming run at step {context.step}")
+            return context, None
+
+        context = RunContext(image=image, callbacks=callbacks or [], key=key, deadline=deadline)
+        context.callback("on_agent_start", image=image)
+        self.initialize(context)
+        if not isinstance(context.ocr_content, str):
+            logger.error ("No text could be read from the image")
+        elif not force:
+            cached_result = self._check_agent_cache(context.ocr_content, prefix)
             if cached_result:
                 logger.info ("Using cached value for agent")
-                self._callback_handler("on_agent_end", calendar=cached_result[0])
-                return cached_result
+                context.callback("on_agent_end", calendar=cached_result[0])
+                self.journal.record_run(context, "multi" if prefix == MULTI_PREFIX else "single", "cached")
+                return context, cached_result
+        self.checkpoints.save(context)
+        return context, None
+
+    def _solve(self, context: RunContext, max_steps: int) -> Optional[str]:
+        """Plan and run commands until the agent is done, then return the iCalendar."""
         assistant_reply: Optional[Action] = None
-        for step in range(2, max_steps):
-            self._callback_handler("on_step", step=step)
-            assistant_reply = self.chain.run(memory = self.memory_template, commands = self.tools_template, callbacks=self.callbacks)
-            self._callback_handler("on_step", step=step, assistant_reply=assistant_reply)
-            if assistant_reply.command is None:
-                logger.info ("I'm done!")
+        first_step = context.step
+        for step in range(context.step, max_steps):
+            context.step = step
+            if context.remaining() < FINISH_RESERVE + PLANNING_ESTIMATE:
+                logger.warning ("Close to the deadline, producing the iCalendar now")
                 break
-            try:
-                tool = list(filter(lambda x: x.name == assistant_reply.command.name, self.tools))[0]
-            except AttributeError as ex:
-                logger.error (ex)
-                continue
-
-            observation = tool.run(dict(zip(tool.args, assistant_reply.command.args)))
-            self.full_message_history.append({"id": len(self.full_message_history), 
-                                        "name": assistant_reply.command.name, 
-                                        "args": assistant_reply.command.args, 
-                                        "result": try_loads(observation, True)})
-
-        if assistant_reply.iCalendar:
-            self._callback_handler("on_agent_end", calendar=assistant_reply.iCalendar)
-            self._save_agent_cache(self.full_message_history[1]["result"], assistant_reply.iCalendar, assistant_reply.event)
-            return assistant_reply.iCalendar, assistant_reply.event
-        else:
-            # last try, now using icalendar chain
-            self._callback_handler("on_step", step=step)
-            calendar_reply:iCalendar = self.chain_icalendar.run(memory = self.memory_template, callbacks=self.callbacks)
-            if calendar_reply.iCalendar:
-                self._callback_handler("on_agent_end", calendar=calendar_reply.iCalendar)
-                self._save_agent_cache(self.full_message_history[1]["result"], calendar_reply.iCalendar, assistant_reply.event)
-                return calendar_reply.iCalendar, assistant_reply.event
+            early_call: Optional[Tuple[Command, ToolCall]] = None
+            if context.pending_command is None:
+                context.callback("on_step", step=step)
+                model = self.router.choose(context, step, first_step, max_steps)
+                # with a streaming model, the command starts running as soon as it is generated, while the thoughts are still streamed
+                def dispatch(command: Dict[str, Any]) -> None:
+                    nonlocal early_call
+                    try:
+                        command = Command.parse_obj(command)
+                    except ValidationError:
+                        return
+                    tool = self.tools_dict.get(command.name)
+                    call = self._submit_tool(context, tool, dict(zip(tool.args, command.args or []))) if tool is not None else None
+                    if call is not None:
+                        logger.info (f"Running {command.name} while the reply is generated")
+                        early_call = (command, call)
+                try:
+                    assistant_reply = self._call_chain(context, model, self.planners[model], extra_callbacks=[CommandStreamHandler(dispatch)],
+                                                       memory = context.memory_template, commands = self.tools_template)
+                except Exception as ex:
+                    # e.g. the request timed out close to the deadline; what is known so far goes to the iCalendar chain
+                    logger.error (f"Planning step {step} failed ({ex}), producing the iCalendar now")
+                    if early_call is not None:
+                        early_call[1].abandon()
+                    assistant_reply = None
+                    break
+                context.callback("on_step", step=step, assistant_reply=assistant_reply, model=model)
+                context.event = assistant_reply.event
+                if assistant_reply.command is None:
+                    logger.info ("I'm done!")
+                    break
+                context.pending_command = assistant_reply.command.dict()
+                self.checkpoints.save(context)
+
+            command = Command.parse_obj(context.pending_command)
+            tool = self.tools_dict.get(command.name)
+            call = None
+            if early_call is not None:
+                if early_call[0] == command:
+                    call = early_call[1]
+                else:
+                    # the result of the streamed command is not used (it's still cached for later, if it runs)
+                    logger.warning (f"Streamed command {early_call[0]} differs from the final one {command}")
+                    early_call[1].abandon()
+            if tool is None:
+                logger.error (f"Unknown command {command.name}")
             else:
-                self._callback_handler("on_agent_end", calendar=None)
-                logger.error ("No iCalendar found")
-                return None, assistant_reply.event
+                observation = self._run_tool(context, tool, dict(zip(tool.args, command.args or [])), call)
+                context.append(command.name, try_loads(observation, True), args=command.args)
+            context.pending_command = None
+            context.step = step + 1
+            self.checkpoints.save(context)
+
+        if assistant_reply and assistant_reply.iCalendar:
+            return assistant_reply.iCalendar
+        # last try, now using icalendar chain
+        context.callback("on_step", step=context.step)
+        calendar_reply:iCalendar = self._call_chain(context, STRONG, self.chain_icalendar, kind="icalendar", reserve=0,
+                                                    memory = context.memory_template)
+        if not calendar_reply.iCalendar:
+            logger.error ("No iCalendar found")
+        return calendar_reply.iCalendar
+
+    def _call_chain(self, context: RunContext, model: str, chain: LLMChain, kind: str = "plan",
+                    extra_callbacks: Optional[List[BaseCallbackHandler]] = None, reserve: float = FINISH_RESERVE, **inputs: Any) -> Any:
+        """Run a chain, accounting its tokens and latency to the model deployment.
+
+        Its requests time out so that the chain (retries included) ends `reserve`
+        seconds before the deadline of the run.
+        """
+        usage = UsageCallbackHandler()
+        started, start = time.time(), time.monotonic()
+        error = True
+        try:
+            result = self._with_timeout(chain, context.remaining() - reserve).run(**inputs, callbacks=context.callbacks + [usage] + (extra_callbacks or []))
+            error = False
+            return result
+        finally:
+            seconds = time.monotonic() - start
+            context.record_usage(model, usage.tokens, seconds)
+            # streamed replies come without token usage, handlers get the estimate of UsageCallbackHandler
+            context.callback("on_usage", model=model, kind=kind, tokens=usage.tokens, seconds=seconds)
+            self.journal.record_step(context, kind, model, started, seconds, tokens=usage.tokens, error=error)
+
+    @staticmethod
+    def _with_timeout(chain: LLMChain, seconds: float) -> LLMChain:
+        """Copy of the chain whose model requests time out in time for `seconds` (whole retries included)."""
+        if math.isinf(seconds):
+            return chain
+        # a request needs some time anyway, the deadline is overrun by a few seconds at worst
+        timeout = min(CHAIN_TIMEOUT, max(seconds / (CHAIN_RETRIES + 1), 10))
+        return chain.copy(update={"llm_kwargs": {**chain.llm_kwargs, "request_timeout": timeout}})
+
+    def _finish(self, context: RunContext, calendar: Optional[str], prefix: str = "") -> Tuple[Optional[str], Optional[str]]:
+        logger.info (f"Model usage: {context.model_usage}")
+        context.callback("on_agent_end", calendar=calendar, usage=context.model_usage)
+        if calendar and isinstance(context.ocr_content, str):
+            self._save_agent_cache(context.ocr_content, calendar, context.event, prefix)
+        self.checkpoints.complete(context)
+        self.journal.record_run(context, "multi" if prefix == MULTI_PREFIX else "single", "done" if calendar else "no_calendar")
+        return calendar, context.event
 
     def _generate_tools(self, tools: List[BaseTool]) -> List[str]:
         command_strings = [
@@ -146,18 +480,11 @@ class img2calendar:
     def _generate_command_string(self, tool: BaseTool) -> str:
         return f'{json.dumps([tool.name] + list(tool.args.keys())).replace("[","").replace("]","")} : {tool.description}, '
 
-    def _callback_handler(self, event_name, *args, **kwargs: Any) -> Any:
-        """Run a callback handler."""
-        for callback in self.callbacks:
-            try:
-                getattr(callback, event_name)(*args, **kwargs)
-            except NotImplementedError as e:
-                logger.warning(f"Callback {callback} does not implement {event_name}")
-
 
-def make_agent(callbacks: Optional[List[BaseCallbackHandler]] = None):
+def make_agent(streaming: bool = True):
+    """Build the agent; with `streaming`, planning replies are streamed and their commands start before the reply ends."""
     from langchain.chat_models import AzureChatOpenAI, ChatOpenAI
-    from langchain import PromptTemplate
+    from langchain import LLMChain, PromptTemplate
     from langchain.output_parsers.openai_functions import PydanticOutputFunctionsParser
     from langchain.chains.question_answering import load_qa_chain
     from langchain.chains.openai_functions import (
@@ -169,27 +496,35 @@ def make_agent(callbacks: Optional[List[BaseCallbackHandler]] = None):
     from src.tools.gmaps import SerpAPILocation
     from src.tools.webpageqa import WebpageQA
     from src.tools.ocr import OcrTool
+    from src.tools.ocr_engines import TesseractEngine
 
-    from src.llm.prompt import PROMPT, ICALENDAR
-    from src.llm.models import Action, iCalendar
+    from src.llm.prompt import PROMPT, ICALENDAR, SPLIT, WEBPAGE_MAP, WEBPAGE_REDUCE
+    from src.llm.models import Action, ChunkAnswer, EventCandidates, iCalendar
 
 
-    llm = AzureChatOpenAI(deployment_name="agent", temperature=0, verbose=True) # type: ignore
-    llm_chat = AzureChatOpenAI(deployment_name="chat", temperature=0, verbose=True) # type: ignore
+    llm = AzureChatOpenAI(deployment_name="agent", temperature=0, verbose=True, request_timeout=CHAIN_TIMEOUT, max_retries=CHAIN_RETRIES) # type: ignore
+    llm_chat = AzureChatOpenAI(deployment_name="chat", temperature=0, verbose=True, request_timeout=CHAIN_TIMEOUT, max_retries=CHAIN_RETRIES) # type: ignore
 
-    webpageqa = WebpageQA(qa_chain=load_qa_chain(llm_chat, chain_type="stuff"))
+    webpageqa = WebpageQA(qa_chain=load_qa_chain(llm_chat, chain_type="stuff"),
+                          map_chain=create_structured_output_chain(ChunkAnswer, llm_chat, PromptTemplate(template=WEBPAGE_MAP, input_variables=['context', 'question'])),
+                          reduce_chain=LLMChain(llm=llm_chat, prompt=PromptTemplate(template=WEBPAGE_REDUCE, input_variables=['answers', 'question'])))
     google = SerpAPISearch()
     gmaps = SerpAPILocation()
-    ocr = OcrTool()
+    ocr = OcrTool(local_engine=TesseractEngine() if TesseractEngine.is_available() else None)
 
     tools = [ocr, google, gmaps, webpageqa]
 
-    for tool in tools:
-        tool.callbacks = None
-    chain = create_openai_fn_chain([Action], llm, prompt=PromptTemplate(template=PROMPT, input_variables=['memory', 'commands']),
+    # planning chains, streamed so that commands can run while the thoughts are generated
+    llm_planner = AzureChatOpenAI(deployment_name="agent", temperature=0, verbose=True, request_timeout=CHAIN_TIMEOUT, max_retries=CHAIN_RETRIES, streaming=streaming) # type: ignore
+    llm_chat_planner = AzureChatOpenAI(deployment_name="chat", temperature=0, verbose=True, request_timeout=CHAIN_TIMEOUT, max_retries=CHAIN_RETRIES, streaming=streaming) # type: ignore
+    chain = create_openai_fn_chain([Action], llm_planner, prompt=PromptTemplate(template=PROMPT, input_variables=['memory', 'commands']),
+                                output_parser=PydanticOutputFunctionsParser(pydantic_schema=Action))
+    # same planning chain on the fast deployment, for the simple steps chosen by the router
+    chain_fast = create_openai_fn_chain([Action], llm_chat_planner, prompt=PromptTemplate(template=PROMPT, input_variables=['memory', 'commands']),
                                 output_parser=PydanticOutputFunctionsParser(pydantic_schema=Action))
     chain_icalendar = create_structured_output_chain(iCalendar, llm, PromptTemplate(template=ICALENDAR, input_variables=['memory']))
+    chain_split = create_structured_output_chain(EventCandidates, llm_chat, PromptTemplate(template=SPLIT, input_variables=['memory']))
 
-    agent = img2calendar.from_chain_and_tools(PROMPT, tools, chain, chain_icalendar, callbacks=callbacks)
+    agent = img2calendar.from_chain_and_tools(PROMPT, tools, chain, chain_icalendar, chain_split=chain_split, chain_fast=chain_fast)
 
     return agent
@@ -1,7 +1,9 @@
 import re
+import threading
 from typing import Tuple, List, Optional, Any, Dict
 from uuid import UUID
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from datetime import datetime as dt
 from collections import defaultdict
 from langchain.callbacks.base import BaseCallbackHandler
@@ -15,7 +17,10 @@ from src.llm.models import Action
 from src.utils import try_loads
 
 class OutputCallbackHandler(BaseCallbackHandler):
-    run_total_tokens: List[int] = []
+    """Logging callback handler; create one instance per agent run."""
+
+    def __init__(self) -> None:
+        self.reset()
 
     def reset(self) -> None:
         """Reset the callback handler."""
@@ -30,8 +35,20 @@ class OutputCallbackHandler(BaseCallbackHandler):
         """Run when agent starts running."""
         logger.info("AGENT ENDED")
         logger.info(calendar)
+        # the usage of the run also counts the sub-agents of multi-event runs, which run without callbacks
+        usage = kwargs.get("usage")
+        logger.info(f"Total tokens in all steps: {sum(model['tokens'] for model in usage.values()) if usage else sum(self.run_total_tokens)}")
+
+    def on_usage(self, model: str, kind: str, tokens: int, seconds: float, **kwargs: Any) -> None:
+        """Run after every chain call of the agent, with its tokens (estimated for streamed replies)."""
+        self.run_total_tokens.append(tokens)
 
 
+    def on_profile(self, summary: Dict[str, Any], path: str, **kwargs: Any) -> None:
+        """Run when the profile of the run is saved (profiled runs only)."""
+        logger.info(f"PROFILE saved to {path}")
+        logger.info("\n" + pformat({"labels": summary["labels"], "hottest": summary["hottest"][:5], "allocations": summary["allocations"][:5]}))
+
     def on_step(self, step: int, **kwargs: Any) -> None:
         """Run when agent process thoughts."""
         logger.info("STEP")
@@ -54,7 +71,6 @@ class OutputCallbackHandler(BaseCallbackHandler):
                 logger.info("\n" + pformat(function_calling))
         except:
             pass
-        self.run_total_tokens.append(response.llm_output["token_usage"]["total_tokens"])
 
     def on_tool_start(self, serialized: Dict[str, Any], input_str: str, **kwargs: Any) -> Any:
         """Run when tool starts running."""
@@ -78,14 +94,18 @@ class OutputCallbackHandler(BaseCallbackHandler):
 
 
 class StreamlitCallbackHandler(BaseCallbackHandler):
-    tool_history: Dict[str, Dict[str, str]] = {}
-    run_total_tokens: List[int] = []
-    run_total_tools: dict[str, List[int]] = defaultdict(list)
+    """Streamlit callback handler; create one instance per agent run."""
+
+    def __init__(self) -> None:
+        self.reset()
 
     def reset(self) -> None:
         """Reset the callback handler."""
-        self.tool_history = {}
-        self.run_total_tokens = []
+        self.tool_history: Dict[str, Dict[str, str]] = {}
+        self.run_total_tokens: List[int] = []
+        self.run_total_tools: Dict[str, List[float]] = defaultdict(list)
+        # start of every tool call (a streamed command may run while the reply is generated)
+        self._tool_timers: Dict[UUID, dt] = {}
 
     def set_app(self, steps: int, pb: st.progress, tabs: st.tabs, result: st.container):
         self._steps = steps
@@ -93,7 +113,13 @@ class StreamlitCallbackHandler(BaseCallbackHandler):
         self._pb = pb
         self._tabs = tabs
         self._result = result
-        self._timer: dt = dt.now()
+        self._llm_timer: dt = dt.now()
+        # tools run on the agent's worker threads, which need the script context to update the app
+        self._script_ctx = get_script_run_ctx()
+
+    def _attach(self) -> None:
+        if getattr(self, "_script_ctx", None) is not None and get_script_run_ctx() is None:
+            add_script_run_ctx(threading.current_thread(), self._script_ctx)
 
     def on_agent_start(self, **kwargs: Any) -> None:
         """Run when agent starts running."""
@@ -109,9 +135,24 @@ class StreamlitCallbackHandler(BaseCallbackHandler):
             # self._result.success("```\n"+calendar+"\n```")
             self._result.text_area("iCalendar", calendar, height=300, disabled=True)
             self._result.download_button('Download iCalendar', calendar, file_name='event.ics', mime='text/calendar')
-        self._result.info(f"Total tokens in all steps: {sum(self.run_total_tokens)}")
-        self._result.info(f"Total time: {round(sum(sum(self.run_total_tools.values(), [])),2)}s. Total time per tool:")
-        self._result.bar_chart({key:sum(value) for key, value in self.run_total_tools.items()})
+        # the usage of the run also counts the sub-agents of multi-event runs, which run without callbacks
+        usage = kwargs.get("usage")
+        self._result.info(f"Total tokens in all steps: {int(sum(model['tokens'] for model in usage.values())) if usage else sum(self.run_total_tokens)}")
+        if kwargs.get("usage"):
+            self._result.info("Usage per model: " + ", ".join(f"{model}: {int(usage['calls'])} calls, {int(usage['tokens'])} tokens, {round(usage['seconds'], 2)}s"
+                                                          for model, usage in kwargs["usage"].items()))
+        tools_panel, self._profile_panel = self._result.columns(2)
+        tools_panel.info(f"Total time: {round(sum(sum(self.run_total_tools.values(), [])),2)}s. Total time per tool:")
+        tools_panel.bar_chart({key:sum(value) for key, value in self.run_total_tools.items()})
+
+    def on_profile(self, summary: Dict[str, Any], path: str, **kwargs: Any) -> None:
+        """Run when the profile of the run is saved (profiled runs only)."""
+        panel = getattr(self, "_profile_panel", self._result)
+        panel.info(f"Profile: {summary['samples']} samples in {summary['seconds']}s, peak memory {round(summary['peak_kb'] / 1024, 1)}MB. Sampled time per tool:")
+        panel.bar_chart({label: stats["samples"] * summary["interval"] for label, stats in summary["labels"].items()})
+        panel.dataframe(summary["hottest"][:10], use_container_width=True)
+        panel.dataframe(summary["allocations"][:10], use_container_width=True)
+        panel.caption(f"Saved to {path} (stacks.folded can be opened with speedscope or flamegraph.pl)")
 
     def on_step(self, step: int, **kwargs: Any) -> None:
         """Run when agent process thoughts."""
@@ -126,7 +167,7 @@ class StreamlitCallbackHandler(BaseCallbackHandler):
         """Run when LLM starts running."""
         logger.info("LLM STARTED")
         self._pb.progress(self._current_step/self._steps, text=f"[{self._current_step+1}] Calling GPT4 ...")
-        self._timer = dt.now()
+        self._llm_timer = dt.now()
 
     def on_llm_end(self, response: LLMResult, **kwargs: Any) -> Any:
         """Run when LLM ends running."""
@@ -137,20 +178,25 @@ class StreamlitCallbackHandler(BaseCallbackHandler):
                 logger.info("\n" + pformat(function_calling))
         except:
             logger.warning("No function calling found")
-        self.run_total_tools["llm"].append((dt.now() - self._timer).total_seconds())
-        self.run_total_tokens.append(response.llm_output["token_usage"]["total_tokens"])
+        self.run_total_tools["llm"].append((dt.now() - self._llm_timer).total_seconds())
+
+    def on_usage(self, model: str, kind: str, tokens: int, seconds: float, **kwargs: Any) -> None:
+        """Run after every chain call of the agent, with its tokens (estimated for streamed replies)."""
+        self.run_total_tokens.append(tokens)
 
     def on_tool_start(self, serialized: Dict[str, Any], input_str: str, **kwargs: Any) -> Any:
         """Run when tool starts running."""
         logger.info("TOOL STARTED")
+        self._attach()
         self.tool_history[kwargs["run_id"]] = {"name": serialized["name"], "input": input_str}
         self._pb.progress(self._current_step/self._steps, text=f"[{self._current_step+1}] Calling {serialized['name']} ...")
-        self._timer = dt.now()
+        self._tool_timers[kwargs["run_id"]] = dt.now()
 
     def on_tool_end(self, output: str, **kwargs: Any) -> Any:
         """Run when tool ends running."""
         logger.info("TOOL ENDED")
-        self.run_total_tools[kwargs["name"]].append((dt.now() - self._timer).total_seconds())
+        self._attach()
+        self.run_total_tools[kwargs["name"]].append((dt.now() - self._tool_timers.pop(kwargs["run_id"], dt.now())).total_seconds())
         self.tool_history[kwargs["run_id"]]["output"] = output
         self._format_command(self.tool_history[kwargs["run_id"]], output, self._tabs[self._current_step])
 
@@ -0,0 +1,107 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import duckdb
+from langchain.callbacks.base import BaseCallbackHandler
+from loguru import logger
+
+from src.llm.context import RunContext
+
+DEFAULT_CHECKPOINTS = Path(Path(__file__).absolute().parent.parent.parent / "data" / "checkpoints.ndjson")
+DEFAULT_TTL = 24 * 60 * 60
+# the store is compacted when a run completes and the file has grown over this size
+DEFAULT_MAX_BYTES = 8 * 1024 * 1024
+
+COLUMNS = "{'key': 'VARCHAR', 'run_id': 'VARCHAR', 'ts': 'DOUBLE', 'step': 'INTEGER', 'done': 'BOOLEAN', 'event': 'VARCHAR', 'pending': 'VARCHAR', 'messages': 'VARCHAR'}"
+
+
+class CheckpointStore:
+    """Append-only store of agent run checkpoints, keyed by image hash.
+
+    Every record only carries the messages added since the previous checkpoint
+    of the same run, so writing a checkpoint is a single small append. A run is
+    restored by replaying the records of the latest run for the image.
+    Finished and expired runs are dropped by `compact`, which also runs when a
+    run completes and the file is over `max_bytes`.
+    """
+
+    def __init__(self, checkpoint_file: Path = DEFAULT_CHECKPOINTS, ttl: float = DEFAULT_TTL,
+                 max_bytes: Optional[int] = DEFAULT_MAX_BYTES):
+        self.checkpoint_file = checkpoint_file
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def save(self, context: RunContext, done: bool = False) -> None:
+        messages = context.full_message_history[context.checkpointed:]
+        record = {"key": context.key,
+                  "run_id": context.run_id,
+                  "ts": time.time(),
+                  "step": context.step,
+                  "done": done,
+                  "event": context.event,
+                  "pending": json.dumps(context.pending_command),
+                  "messages": json.dumps(messages)}
+        with self._lock, open(self.checkpoint_file, "a") as file:
+            file.write(json.dumps(record) + "\n")
+        context.checkpointed = len(context.full_message_history)
+
+    def complete(self, context: RunContext) -> None:
+        """Mark the run as finished, so it is not resumed anymore."""
+        self.save(context, done=True)
+        if self.max_bytes is not None and self.checkpoint_file.stat().st_size > self.max_bytes:
+            logger.info(f"Compacting checkpoints: {self.compact()}")
+
+    def restore(self, key: str, image: str, callbacks: Optional[List[BaseCallbackHandler]] = None) -> Optional[RunContext]:
+        """Rebuild the context of the latest unfinished and unexpired run for `key`."""
+        if not self.checkpoint_file.exists() or self.checkpoint_file.stat().st_size == 0:
+            return None
+        select_script = f"""SELECT run_id, ts, step, done, event, pending, messages
+        FROM read_ndjson('{self.checkpoint_file}', columns={COLUMNS})
+        WHERE run_id = (SELECT run_id FROM read_ndjson('{self.checkpoint_file}', columns={COLUMNS})
+                        WHERE key = ? ORDER BY ts DESC LIMIT 1)
+        ORDER BY ts
+        """
+        records = duckdb.connect().execute(select_script, [key]).fetchall()
+        if len(records) == 0:
+            return None
+        run_id, ts, step, done, event, pending, _ = records[-1]
+        if done or ts < time.time() - self.ttl:
+            return None
+        context = RunContext(image=image, callbacks=callbacks or [], key=key, run_id=run_id,
+                             step=step, event=event, pending_command=json.loads(pending))
+        for record in records:
+            context.full_message_history.extend(json.loads(record[-1]))
+        context.checkpointed = len(context.full_message_history)
+        logger.info(f"Restored checkpoint of run {run_id} at step {step}")
+        return context
+
+    def compact(self) -> Dict[str, int]:
+        """Rewrite the store, dropping finished and expired runs."""
+        if not self.checkpoint_file.exists():
+            return {"runs": 0, "dropped": 0, "bytes": 0}
+        with self._lock:
+            runs = {}
+            with open(self.checkpoint_file) as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    runs.setdefault(record["run_id"], []).append(record)
+            deadline = time.time() - self.ttl
+            kept = 0
+            tmp_file = self.checkpoint_file.with_suffix(".tmp")
+            with open(tmp_file, "w") as file:
+                for records in runs.values():
+                    if records[-1]["done"] or records[-1]["ts"] < deadline:
+                        continue
+                    kept += 1
+                    for record in records:
+                        file.write(json.dumps(record) + "\n")
+            os.replace(tmp_file, self.checkpoint_file)
+        return {"runs": kept, "dropped": len(runs) - kept, "bytes": self.checkpoint_file.stat().st_size}
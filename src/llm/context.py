@@ -0,0 +1,95 @@
+from __future__ import annotations
+import json
+import math
+import time
+from dataclasses import dataclass, field
+from uuid import uuid4
+from typing import Any, Dict, List, Optional
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+from loguru import logger
+
+
+@dataclass
+class RunContext:
+    """Per-run state of an agent run.
+
+    The agent itself only holds immutable configuration (chains and tools), so
+    everything that changes while processing a poster lives here and is passed
+    through `img2calendar.run`.
+    """
+    image: str
+    callbacks: List[BaseCallbackHandler] = field(default_factory=list)
+    key: Optional[str] = None
+    run_id: str = field(default_factory=lambda: uuid4().hex)
+    # run of a multi-event poster this run belongs to
+    parent_id: Optional[str] = None
+    # time.time() value at which the run started (or was resumed)
+    started: float = field(default_factory=time.time)
+    full_message_history: List[Dict[str, Any]] = field(default_factory=list)
+    step: int = 0
+    event: Optional[str] = None
+    pending_command: Optional[Dict[str, Any]] = None
+    total_tokens: int = 0
+    # calls, tokens and seconds spent on every model deployment
+    model_usage: Dict[str, Dict[str, float]] = field(default_factory=dict)
+    # time.monotonic() value at which the run must be finished (no limit if None)
+    deadline: Optional[float] = None
+    # number of messages already written to the checkpoint store
+    checkpointed: int = 0
+    # compact JSON of the messages already encoded for the prompts (the history is append-only)
+    _encoded: List[str] = field(default_factory=list, init=False, repr=False, compare=False)
+    _encoded_for: Optional[List[Dict[str, Any]]] = field(default=None, init=False, repr=False, compare=False)
+
+    @property
+    def memory_template(self) -> str:
+        if self._encoded_for is not self.full_message_history or len(self._encoded) > len(self.full_message_history):
+            self._encoded, self._encoded_for = [], self.full_message_history
+        for message in self.full_message_history[len(self._encoded):]:
+            self._encoded.append(json.dumps(message, ensure_ascii=False, separators=(",", ":")))
+        return "[" + ",".join(self._encoded) + "]"
+
+    @property
+    def ocr_content(self) -> Optional[str]:
+        if len(self.full_message_history) > 1:
+            return self.full_message_history[1]["result"]
+        return None
+
+    def remaining(self) -> float:
+        """Seconds left before the deadline of the run."""
+        if self.deadline is None:
+            return math.inf
+        return self.deadline - time.monotonic()
+
+    def record_usage(self, model: str, tokens: int, seconds: float) -> None:
+        usage = self.model_usage.setdefault(model, {"calls": 0, "tokens": 0, "seconds": 0.})
+        usage["calls"] += 1
+        usage["tokens"] += tokens
+        usage["seconds"] += seconds
+        self.total_tokens += tokens
+
+    def merge_usage(self, other: RunContext) -> None:
+        for model, usage in other.model_usage.items():
+            total = self.model_usage.setdefault(model, {"calls": 0, "tokens": 0, "seconds": 0.})
+            for name, value in usage.items():
+                total[name] += value
+        self.total_tokens += other.total_tokens
+
+    def append(self, name: str, result: Any, args: Optional[List[str]] = None) -> None:
+        message = {"id": len(self.full_message_history), "name": name}
+        if args is not None:
+            message["args"] = args
+        message["result"] = result
+        self.full_message_history.append(message)
+
+    def callback(self, event_name: str, *args, **kwargs: Any) -> None:
+        """Run a callback handler; handlers without the event (e.g. plain langchain ones) are skipped."""
+        for callback in self.callbacks:
+            handler = getattr(callback, event_name, None)
+            if handler is None:
+                continue
+            try:
+                handler(*args, **kwargs)
+            except NotImplementedError:
+                logger.warning(f"Callback {callback} does not implement {event_name}")
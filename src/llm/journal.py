@@ -0,0 +1,192 @@
+"""Journal of the agent runs: one row per run and one per step, in parquet files queried with duckdb.
+
+    python -m src.llm.journal report [tool_latency|tokens_per_poster|steps|cache_savings]
+    python -m src.llm.journal query "SELECT count(*) FROM runs"
+    python -m src.llm.journal compact
+"""
+import argparse
+import atexit
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+from uuid import uuid4
+
+import duckdb
+from loguru import logger
+
+from src.llm.context import RunContext
+
+DEFAULT_JOURNAL_DIR = Path(Path(__file__).absolute().parent.parent.parent / "data" / "journal")
+
+SCHEMAS = {
+    "runs": {"run_id": "VARCHAR", "parent_id": "VARCHAR", "key": "VARCHAR", "mode": "VARCHAR", "status": "VARCHAR",
+             "started": "TIMESTAMP", "seconds": "DOUBLE", "steps": "INTEGER", "tokens": "INTEGER", "llm_calls": "INTEGER",
+             "event": "VARCHAR"},
+    "steps": {"run_id": "VARCHAR", "step": "INTEGER", "kind": "VARCHAR", "name": "VARCHAR", "started": "TIMESTAMP",
+              "seconds": "DOUBLE", "tokens": "INTEGER", "cache_hit": "BOOLEAN", "error": "BOOLEAN"},
+}
+
+REPORTS = {
+    # latency of every tool, and of the calls actually run (not answered by the cache)
+    "tool_latency": """
+        SELECT name AS tool, count(*) AS calls,
+               round(quantile_cont(seconds, 0.5), 2) AS p50, round(quantile_cont(seconds, 0.95), 2) AS p95,
+               round(quantile_cont(seconds, 0.5) FILTER (WHERE NOT coalesce(cache_hit, false)), 2) AS p50_uncached,
+               round(avg(cache_hit::INTEGER), 2) AS hit_rate, sum(error::INTEGER) AS errors
+        FROM steps WHERE kind = 'tool' GROUP BY name ORDER BY p95 DESC""",
+    "tokens_per_poster": """
+        SELECT mode, count(*) AS runs, round(avg(tokens)) AS avg_tokens,
+               quantile_disc(tokens, 0.5) AS p50, quantile_disc(tokens, 0.95) AS p95, max(tokens) AS max,
+               round(avg(llm_calls), 1) AS avg_llm_calls
+        FROM runs WHERE parent_id IS NULL AND status != 'cached' GROUP BY mode ORDER BY mode""",
+    # steps needed to finish a poster, to tune max_steps
+    "steps": """
+        SELECT steps, count(*) AS runs, sum((status = 'done')::INTEGER) AS with_calendar,
+               round(avg(seconds), 1) AS avg_seconds, round(avg(tokens)) AS avg_tokens
+        FROM runs WHERE parent_id IS NULL AND status != 'cached' GROUP BY steps ORDER BY steps""",
+    # cache hits, valued at the median latency of the calls that missed
+    "cache_savings": """
+        WITH tools AS (
+            SELECT name, count(*) FILTER (WHERE cache_hit) AS hits, count(*) FILTER (WHERE NOT cache_hit) AS misses,
+                   median(seconds) FILTER (WHERE NOT cache_hit) AS miss_seconds, 0 AS miss_tokens
+            FROM steps WHERE kind = 'tool' AND cache_hit IS NOT NULL GROUP BY name
+        ), agent AS (
+            SELECT 'agent' AS name, count(*) FILTER (WHERE status = 'cached') AS hits,
+                   count(*) FILTER (WHERE status != 'cached') AS misses,
+                   median(seconds) FILTER (WHERE status != 'cached') AS miss_seconds,
+                   median(tokens) FILTER (WHERE status != 'cached') AS miss_tokens
+            FROM runs WHERE parent_id IS NULL
+        )
+        SELECT name, hits, misses, round(hits / nullif(hits + misses, 0), 2) AS hit_rate,
+               round(hits * coalesce(miss_seconds, 0)) AS seconds_saved, round(hits * coalesce(miss_tokens, 0)) AS tokens_saved
+        FROM (SELECT * FROM tools UNION ALL SELECT * FROM agent) ORDER BY seconds_saved DESC""",
+}
+
+
+class RunJournal:
+    """Buffered writer of run and step rows.
+
+    Recording a row only puts it in a queue; a background thread writes the
+    rows in batches, one parquet file per table and batch, every
+    `flush_interval` seconds or `batch_size` rows.
+    """
+
+    def __init__(self, journal_dir: Path = DEFAULT_JOURNAL_DIR, batch_size: int = 500, flush_interval: float = 10):
+        self.journal_dir = Path(journal_dir)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._writer, name="journal", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def record_step(self, context: RunContext, kind: str, name: str, started: float, seconds: float,
+                    tokens: int = 0, cache_hit: Optional[bool] = None, error: bool = False) -> None:
+        self._put("steps", (context.run_id, context.step, kind, name, started, seconds, tokens, cache_hit, error))
+
+    def record_run(self, context: RunContext, mode: str, status: str) -> None:
+        llm_calls = sum(usage["calls"] for usage in context.model_usage.values())
+        self._put("runs", (context.run_id, context.parent_id, context.key, mode, status, context.started,
+                           time.time() - context.started, context.step, context.total_tokens, llm_calls, context.event))
+
+    def _put(self, table: str, row: tuple) -> None:
+        self._queue.put((table, row))
+        if self._queue.qsize() >= self.batch_size:
+            self._wake.set()
+
+    def _writer(self) -> None:
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> None:
+        """Write the queued rows."""
+        with self._flush_lock:
+            rows: Dict[str, List[tuple]] = {table: [] for table in SCHEMAS}
+            while True:
+                try:
+                    table, row = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                rows[table].append(row)
+            for table, table_rows in rows.items():
+                for start in range(0, len(table_rows), self.batch_size):
+                    try:
+                        self._write(table, table_rows[start:start + self.batch_size])
+                    except Exception as ex:
+                        logger.error(f"Could not write {table} journal rows: {ex}")
+
+    def _write(self, table: str, rows: List[tuple]) -> None:
+        table_dir = self.journal_dir / table
+        table_dir.mkdir(parents=True, exist_ok=True)
+        columns = ", ".join(f"{name} {type_}" for name, type_ in SCHEMAS[table].items())
+        placeholders = ", ".join("to_timestamp(?)::TIMESTAMP" if type_ == "TIMESTAMP" else "?" for type_ in SCHEMAS[table].values())
+        connection = duckdb.connect()
+        connection.execute(f"CREATE TABLE rows ({columns})")
+        connection.executemany(f"INSERT INTO rows VALUES ({placeholders})", rows)
+        path = table_dir / f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid4().hex[:8]}.parquet"
+        connection.execute(f"COPY rows TO '{path}' (FORMAT PARQUET)")
+
+
+def connect(journal_dir: Path = DEFAULT_JOURNAL_DIR) -> duckdb.DuckDBPyConnection:
+    """duckdb connection with a `runs` and a `steps` view over the journal files."""
+    connection = duckdb.connect()
+    for table, schema in SCHEMAS.items():
+        files = sorted(str(path) for path in (Path(journal_dir) / table).glob("*.parquet"))
+        if files:
+            connection.execute(f"CREATE VIEW {table} AS SELECT * FROM read_parquet({files!r}, union_by_name = true)")
+        else:
+            columns = ", ".join(f"{name} {type_}" for name, type_ in schema.items())
+            connection.execute(f"CREATE TABLE {table} ({columns})")
+    return connection
+
+
+def report(name: str, journal_dir: Path = DEFAULT_JOURNAL_DIR) -> duckdb.DuckDBPyRelation:
+    """Result of a built-in report (`.df()`, `.fetchall()` ...)."""
+    return connect(journal_dir).sql(REPORTS[name])
+
+
+def compact(journal_dir: Path = DEFAULT_JOURNAL_DIR) -> Dict[str, int]:
+    """Merge the files of every table into a single one."""
+    merged = {}
+    for table in SCHEMAS:
+        files = sorted((Path(journal_dir) / table).glob("*.parquet"))
+        if len(files) < 2:
+            continue
+        path = Path(journal_dir) / table / f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid4().hex[:8]}.parquet"
+        duckdb.connect().execute(f"COPY (SELECT * FROM read_parquet({[str(file) for file in files]!r}, union_by_name = true)) "
+                                 f"TO '{path}' (FORMAT PARQUET)")
+        for file in files:
+            file.unlink()
+        merged[table] = len(files)
+    return merged
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m src.llm.journal", description="run journal reports")
+    parser.add_argument("--journal-dir", type=Path, default=DEFAULT_JOURNAL_DIR)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    report_parser = subparsers.add_parser("report", help="built-in reports")
+    report_parser.add_argument("reports", nargs="*", help=f"one or more of {', '.join(REPORTS)} (default: all)")
+    query_parser = subparsers.add_parser("query", help="run a query on the runs and steps tables")
+    query_parser.add_argument("sql")
+    subparsers.add_parser("compact", help="merge the journal files")
+    args = parser.parse_args()
+
+    if args.command == "report":
+        for name in args.reports or REPORTS:
+            print(f"# {name}")
+            report(name, args.journal_dir).show(max_width=200)
+    elif args.command == "query":
+        connect(args.journal_dir).sql(args.sql).show(max_width=200)
+    else:
+        print(compact(args.journal_dir))
+
+
+if __name__ == "__main__":
+    main()
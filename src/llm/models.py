@@ -37,12 +37,33 @@ class Event(BaseModel):
 
 class Action(BaseModel):
     """Self-explanatory command"""
+    # command goes first, so that it can be run while the rest of the reply is streamed
+    command: Optional[Command] = Field(description="next command to be executed, only provided if the process is not finished")
     # event: Event = Field(..., description="collected data from the event")
     event: str = Field(..., description="represents the title or designation of the event")
     thoughts: Thoughts = Field(..., description="explain your reasoning process")
-    command: Optional[Command] = Field(description="next command to be executed, only provided if the process is not finished")
     iCalendar: Optional[str] = Field(description="event using iCalendar format. only provided when the process is finished")
 
+class EventCandidate(BaseModel):
+    """Single event announced in a poster"""
+    name: str = Field(..., description="title of the event, or artist/act performing")
+    date: Optional[str] = Field(description="date and time of this event, as written in the poster")
+    details: Optional[str] = Field(description="any other information of the poster specific to this event (venue, stage, price ...)")
+
+class EventCandidates(BaseModel):
+    """Events announced in a poster"""
+    events: List[EventCandidate] = Field(..., description="one item per event; a single item if the poster announces only one event")
+
+class AttributeAnswer(BaseModel):
+    """Value of an event attribute found in a web page"""
+    name: str = Field(..., description="attribute asked in the question, e.g. address, price, start time")
+    value: str = Field(..., description="value of the attribute, as stated in the text")
+
+class ChunkAnswer(BaseModel):
+    """Answer of the question using a fragment of a web page"""
+    requested: List[str] = Field(..., description="every event attribute asked in the question")
+    answers: List[AttributeAnswer] = Field(..., description="only the requested attributes found in the text; empty if none is found")
+
 class iCalendar(BaseModel):
     # thoughts: Thoughts = Field(..., description="explain your reasoning process")
     iCalendar: str = Field(description="event using iCalendar format")
@@ -0,0 +1,165 @@
+"""Opt-in profiling of agent runs.
+
+Stacks of the run thread and of its tool calls are sampled on a background
+thread (wall clock, so time waiting on the network shows up too), and
+allocations are tracked with tracemalloc. Every profiled run is saved in
+`data/profiles/<name>/`: `stacks.folded` (for flamegraph.pl, speedscope ...)
+and `summary.json` (time and samples per tool, hottest functions, top
+allocations).
+"""
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime as dt
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from loguru import logger
+
+PROFILE_ENV = "IMG2CALENDAR_PROFILE"
+DEFAULT_PROFILES_DIR = Path(Path(__file__).absolute().parent.parent.parent / "data" / "profiles")
+
+_CURRENT: ContextVar[Optional["RunProfiler"]] = ContextVar("profiler", default=None)
+# tracemalloc is process wide, it's stopped when the last profiled run ends
+_TRACING = 0
+_TRACING_LOCK = threading.Lock()
+
+
+def profiling_enabled(profile: Optional[bool] = None) -> bool:
+    """`profile` if given, otherwise the IMG2CALENDAR_PROFILE environment variable."""
+    if profile is not None:
+        return profile
+    return os.environ.get(PROFILE_ENV, "").lower() in ("1", "true", "yes")
+
+
+def current_profiler() -> Optional["RunProfiler"]:
+    """Profiler of the run being executed by this thread, if any."""
+    return _CURRENT.get()
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+
+class RunProfiler:
+    """Sample the stacks and track the allocations of a single run.
+
+    Threads take part in the profile inside `track(label)` blocks: the run
+    itself, every tool call and the sub-agents of multi-event runs.
+    """
+
+    def __init__(self, name: str, interval: float = 0.005, top: int = 25, profiles_dir: Path = DEFAULT_PROFILES_DIR):
+        self.name = name
+        self.interval = interval
+        self.top = top
+        self.profiles_dir = Path(profiles_dir)
+        self.stacks: Counter = Counter()
+        self.labels: Dict[str, Dict[str, float]] = defaultdict(lambda: {"calls": 0, "seconds": 0., "samples": 0, "allocated_kb": 0.})
+        self.allocations: List[Dict[str, Any]] = []
+        self.peak_kb = 0.
+        self.seconds = 0.
+        self._threads: Dict[int, List[str]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+
+    def __enter__(self) -> "RunProfiler":
+        global _TRACING
+        with _TRACING_LOCK:
+            if _TRACING == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start(16)
+            _TRACING += 1
+        self._start_snapshot = tracemalloc.take_snapshot()
+        self._start = time.monotonic()
+        self._token = _CURRENT.set(self)
+        self._sampler = threading.Thread(target=self._sample, name="profiler", daemon=True)
+        self._sampler.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        global _TRACING
+        self._stop.set()
+        self._sampler.join()
+        _CURRENT.reset(self._token)
+        self.seconds = time.monotonic() - self._start
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__),
+                                                                     tracemalloc.Filter(False, __file__)])
+        self.peak_kb = tracemalloc.get_traced_memory()[1] / 1024
+        for stat in snapshot.compare_to(self._start_snapshot, "lineno")[:self.top]:
+            frame = stat.traceback[0]
+            self.allocations.append({"location": f"{frame.filename}:{frame.lineno}", "size_kb": round(stat.size_diff / 1024, 1),
+                                     "count": stat.count_diff})
+        with _TRACING_LOCK:
+            _TRACING -= 1
+            if _TRACING == 0:
+                tracemalloc.stop()
+
+    @contextmanager
+    def track(self, label: str) -> Iterator[None]:
+        """Profile the current thread within the block, accounting its time and allocations to `label`."""
+        thread_id = threading.get_ident()
+        token = _CURRENT.set(self)
+        with self._lock:
+            self._threads.setdefault(thread_id, []).append(label)
+        start, allocated = time.monotonic(), tracemalloc.get_traced_memory()[0]
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._threads[thread_id].pop()
+                if not self._threads[thread_id]:
+                    del self._threads[thread_id]
+                stats = self.labels[label]
+                stats["calls"] += 1
+                stats["seconds"] += time.monotonic() - start
+                # process wide, so only approximate when several runs or tools allocate at the same time
+                stats["allocated_kb"] += max(tracemalloc.get_traced_memory()[0] - allocated, 0) / 1024
+            _CURRENT.reset(token)
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, labels in self._threads.items():
+                    frame = frames.get(thread_id)
+                    names = []
+                    while frame is not None:
+                        names.append(_frame_name(frame))
+                        frame = frame.f_back
+                    self.stacks[";".join([labels[-1]] + names[::-1])] += 1
+                    self.labels[labels[-1]]["samples"] += 1
+
+    @property
+    def summary(self) -> Dict[str, Any]:
+        # functions on top of the stacks, i.e. where the time is actually spent
+        hottest: Counter = Counter()
+        for stack, samples in self.stacks.items():
+            hottest[stack.rsplit(";", 1)[-1]] += samples
+        return {"name": self.name,
+                "seconds": round(self.seconds, 2),
+                "interval": self.interval,
+                "samples": sum(self.stacks.values()),
+                "peak_kb": round(self.peak_kb, 1),
+                "labels": {label: {key: round(value, 2) for key, value in stats.items()} for label, stats in self.labels.items()},
+                "hottest": [{"function": function, "samples": samples, "seconds": round(samples * self.interval, 2)}
+                            for function, samples in hottest.most_common(self.top)],
+                "allocations": self.allocations}
+
+    def save(self) -> Path:
+        """Write the folded stacks and the summary of the run; return their directory."""
+        path = self.profiles_dir / f"{dt.now().strftime('%Y%m%d-%H%M%S')}-{self.name}"
+        path.mkdir(parents=True, exist_ok=True)
+        with open(path / "stacks.folded", "w") as file:
+            for stack, samples in self.stacks.most_common():
+                file.write(f"{stack} {samples}\n")
+        with open(path / "summary.json", "w") as file:
+            json.dump(self.summary, file, indent=2)
+        logger.info(f"Profile saved to {path}")
+        return path
@@ -50,6 +50,14 @@ Given the information stated in the memory, please return the event information,
 
 ICALENDAR = SYSTEM_iCALENDAR + AI_MEMORY + EVENT
 
+SPLIT_EVENTS = """
+Given the text of the poster stated in the memory, list the events it announces.
+Posters of festivals, venues or tours often announce several events: every date, act or session taking place on a different date or time is a different event.
+If the poster announces a single event (even if many artists perform in it at the same time), return only that event.
+"""
+
+SPLIT = SYSTEM + AI_MEMORY + SPLIT_EVENTS
+
 AI_CONSTRAINTS_HF = f"""
 FACTS:
 1. Current date is {dt.now().strftime('%d/%m/%Y, %A')}
@@ -73,3 +81,23 @@ This is a human feedback session. You must reason and provide support, consideri
 
 HF = SYSTEM + AI_CONSTRAINTS_HF + AI_MEMORY + AI_COMMANDS_HF
 
+
+WEBPAGE_MAP = """Use the following fragment of a web page to answer the question.
+Only answer with information stated in the fragment; if an attribute is not found, leave it out. Don't try to make up an answer.
+
+FRAGMENT:
+{context}
+---
+
+QUESTION: {question}
+"""
+
+WEBPAGE_REDUCE = """Several fragments of a web page have been questioned separately. Combine their answers into a single concise answer to the question.
+If the answers disagree, prefer the most specific one and mention the alternatives.
+
+ANSWERS:
+{answers}
+---
+
+QUESTION: {question}
+"""
@@ -0,0 +1,80 @@
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, List
+
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.schema import LLMResult
+
+from src.llm.context import RunContext
+
+STRONG = "agent"
+FAST = "chat"
+
+
+@dataclass
+class RoutingPolicy:
+    """When a planning step can use the fast deployment instead of the strong one."""
+    # commands whose observations usually lead to an obvious next command
+    fast_after: FrozenSet[str] = frozenset({"google", "gmaps"})
+    # the first planning steps (the strategy) and the last ones (the iCalendar) stay on the strong model
+    strong_first_steps: int = 1
+    strong_last_steps: int = 1
+    # larger prompts go to the strong model, which has the larger context
+    max_fast_prompt_chars: int = 12000
+
+
+class ModelRouter:
+    """Choose the deployment of every planning step of a run."""
+
+    def __init__(self, policy: RoutingPolicy = None):
+        self.policy = policy or RoutingPolicy()
+
+    def choose(self, context: RunContext, step: int, first_step: int, max_steps: int) -> str:
+        policy = self.policy
+        if step - first_step < policy.strong_first_steps or max_steps - step <= policy.strong_last_steps:
+            return STRONG
+        last = context.full_message_history[-1]
+        if isinstance(last.get("result"), dict) and "error" in last["result"]:
+            # something went wrong, let the strong model recover
+            return STRONG
+        if len(context.memory_template) > policy.max_fast_prompt_chars:
+            return STRONG
+        return FAST if last["name"] in policy.fast_after else STRONG
+
+
+class UsageCallbackHandler(BaseCallbackHandler):
+    """Count the tokens used by the LLM calls of a single chain call.
+
+    Streamed replies come without token usage, so their tokens are estimated
+    from the prompt and the streamed text.
+    """
+
+    def __init__(self) -> None:
+        self.tokens = 0
+        self._prompt = ""
+        self._streamed = ""
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any) -> Any:
+        self._prompt, self._streamed = "".join(prompts), ""
+
+    def on_llm_new_token(self, token: str, *, chunk: Any = None, **kwargs: Any) -> Any:
+        message = getattr(chunk, "message", None)
+        function_call = getattr(message, "additional_kwargs", {}).get("function_call") if message is not None else None
+        self._streamed += token + ((function_call or {}).get("arguments") or "")
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> Any:
+        usage = (response.llm_output or {}).get("token_usage", {})
+        if usage:
+            self.tokens += usage.get("total_tokens", 0)
+        elif self._streamed:
+            self.tokens += count_tokens(self._prompt) + count_tokens(self._streamed)
+
+
+def count_tokens(text: str) -> int:
+    return len(_encoding().encode(text))
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    import tiktoken
+    return tiktoken.get_encoding("cl100k_base")
@@ -0,0 +1,89 @@
+import json
+from typing import Any, Callable, Dict, Optional
+
+from langchain.callbacks.base import BaseCallbackHandler
+from loguru import logger
+
+
+class IncrementalObjectParser:
+    """Parse the top-level fields of a JSON object while it is being generated.
+
+    Text is fed as it arrives; `on_field(name, value)` is called as soon as the
+    value of a top-level field is complete, before the rest of the object.
+    """
+
+    def __init__(self, on_field: Callable[[str, Any], None]):
+        self.on_field = on_field
+        self.buffer = ""
+        self._position = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._key: Optional[str] = None
+        self._value_start: Optional[int] = None
+
+    def feed(self, text: str) -> None:
+        self.buffer += text
+        for position in range(self._position, len(self.buffer)):
+            char = self.buffer[position]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._value_start is None:
+                        self._key = json.loads(self.buffer[self._string_start:position + 1])
+            elif char == '"':
+                self._in_string = True
+                self._string_start = position
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 1:
+                    # an object or array value is complete at its closing bracket, no need to wait for the comma
+                    self._complete(position + 1)
+                elif self._depth == 0:
+                    self._complete(position)
+            elif char == ":" and self._depth == 1:
+                self._value_start = position + 1
+            elif char == "," and self._depth == 1:
+                self._complete(position)
+        self._position = len(self.buffer)
+
+    def _complete(self, end: int) -> None:
+        if self._key is not None and self._value_start is not None:
+            try:
+                value = json.loads(self.buffer[self._value_start:end])
+            except json.JSONDecodeError:
+                logger.warning(f"Could not parse streamed field {self._key}")
+            else:
+                self.on_field(self._key, value)
+        self._key, self._value_start = None, None
+
+
+class CommandStreamHandler(BaseCallbackHandler):
+    """Call `on_command` with the command of a streamed `Action` function call as soon as it is complete.
+
+    Needs a chat model created with `streaming=True`; otherwise no token is
+    streamed and `on_command` is never called.
+    """
+
+    def __init__(self, on_command: Callable[[Dict[str, Any]], None]):
+        self.on_command = on_command
+        self.parser = IncrementalObjectParser(self._on_field)
+        self.dispatched = False
+
+    def _on_field(self, name: str, value: Any) -> None:
+        if name == "command" and isinstance(value, dict) and value.get("name") and not self.dispatched:
+            self.dispatched = True
+            self.on_command(value)
+
+    def on_llm_new_token(self, token: str, *, chunk: Any = None, **kwargs: Any) -> None:
+        message = getattr(chunk, "message", None)
+        function_call = getattr(message, "additional_kwargs", {}).get("function_call") if message is not None else None
+        if function_call and function_call.get("arguments"):
+            self.parser.feed(function_call["arguments"])
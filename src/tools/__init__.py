@@ -0,0 +1 @@
+NOT_FOUND = "NOT FOUND"
@@ -1,5 +1,5 @@
 import json
-from typing import Optional, Type
+from typing import Any, Optional, Type
 
 from langchain import GoogleSerperAPIWrapper
 from langchain.tools import BaseTool
@@ -7,6 +7,7 @@ from pydantic import BaseModel, Field
 
 from src.tools import NOT_FOUND
 from src.tools.map import OpenStreetAPI
+from src.tools.observations import LocationObservation
 from src.utils import cached
 
 
@@ -32,38 +33,33 @@ class SerpAPILocation(BaseTool):
         self.tool = GoogleSerperAPIWrapper(gl='es', hl='es', type="search")
         self.geocoder = OpenStreetAPI()
 
-    @cached(key_func_name="whereis")
     def _run(self, location: str) -> str:
         """Run query through SerpAPI and parse result."""
         try:
-            toret = self._process_response(self.tool.results(f"{self.prefix} {location}"))
+            observation = self._process_response(self._results(f"{self.prefix} {location}"))
         except DidYouMeanError as ex:
-            toret = self._process_response(self.tool.results(ex.whereis))
-        if toret.get("address") is None:
-            toret = self._process_response_if_not_found(location)
-        return json.dumps(toret)
-
-    def _process_response(self, res: dict) -> dict:
-        """Process response from SerpAPI."""
+            observation = self._process_response(self._results(ex.whereis))
+        if observation is None:
+            observation = self._process_response_if_not_found(location)
+        return observation.compact() if observation else json.dumps(NOT_FOUND)
 
+    @cached(namespace="whereis")
+    def _results(self, query: str) -> Any:
+        """Raw SerpAPI response (kept whole in the cache)."""
+        res = self.tool.results(query)
         if "error" in res.keys():
             raise ValueError(f"Got error from SerpAPI: {res['error']}")
-        toret = {}
-        if "searchInformation" in res.keys():
-            if "didYouMean" in res["searchInformation"]:
-                raise DidYouMeanError(whereis=res['searchInformation']['didYouMean'])
-        if ("knowledgeGraph" in res.keys()):
-            toret["address"] = res["knowledgeGraph"]
-        if ("answerBox" in res.keys()):
-            toret["address"] = res["answerBox"].get("answer")
-        return toret
+        return res
+
+    def _process_response(self, res: Any) -> Optional[LocationObservation]:
+        """Process response from SerpAPI."""
+        if isinstance(res, dict) and "didYouMean" in res.get("searchInformation", {}):
+            raise DidYouMeanError(whereis=res['searchInformation']['didYouMean'])
+        return LocationObservation.from_serper(res)
 
-    def _process_response_if_not_found(self, query):
-        response = self.geocoder.whereis(query)
-        if response != NOT_FOUND:
-            response = [{"title": query,
-                         "description": response}]
-        return response
+    def _process_response_if_not_found(self, query) -> Optional[LocationObservation]:
+        place = self.geocoder.locate(query)
+        return LocationObservation.from_nominatim(query, place) if place else None
 
     async def _arun(self, query: str) -> str:
         """Use the tool asynchronously."""
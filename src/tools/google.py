@@ -1,11 +1,10 @@
-import json
-from typing import Optional, Type
+from typing import Any, Optional, Type
 
 from langchain import GoogleSerperAPIWrapper
 from langchain.tools import BaseTool
 from pydantic import BaseModel, Field
 
-from src.tools import NOT_FOUND
+from src.tools.observations import SearchObservation
 from src.utils import cached
 
 
@@ -24,24 +23,17 @@ class SerpAPISearch(BaseTool):
         self.tool = GoogleSerperAPIWrapper(gl='es', hl='es', type="search")
         self.top_k = top_k
 
-    @cached(key_func_name="google")
     def _run(self, query: str) -> str:
         """Run query through SerpAPI and parse result."""
-        response = self._process_response(self.tool.results(query))
-        return json.dumps(response)
+        return SearchObservation.from_serper(self._results(query), self.top_k).compact()
 
-    def _process_response(self, res: dict) -> list:
-        """Process response from SerpAPI."""
-        # self._res = res
+    @cached(namespace="google")
+    def _results(self, query: str) -> Any:
+        """Raw SerpAPI response (kept whole in the cache)."""
+        res = self.tool.results(query)
         if "error" in res.keys():
             raise ValueError(f"Got error from SerpAPI: {res['error']}")
-        if ("organic" in res.keys()):
-            toret = [{'title': d['title'], 
-                      'url': d['link'], 
-                      'description': d['snippet']} for d in res["organic"][:self.top_k]]
-        else:
-            toret = [{"description": NOT_FOUND}]
-        return toret
+        return res
 
     async def _arun(self, query: str) -> str:
         """Use the tool asynchronously."""
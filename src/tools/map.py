@@ -1,4 +1,7 @@
+from typing import Any, Dict
+
 from geopy.geocoders import Nominatim
+from src.tools import NOT_FOUND
 from src.utils import cached
 
 
@@ -6,13 +9,16 @@ class OpenStreetAPI():
     def __init__(self, *args, **kwargs):
         self._tool = Nominatim(user_agent="EventAnalizer-GPT")
 
-    @cached(key_func_name="geocode")
     def whereis(self, location: str) -> str:
         """Run query through OpenStreetAPI geocode.
            Return: City, Region, State, County, Zip, Country
         """
+        place = self.locate(location)
+        return place["display_name"] if place else NOT_FOUND
+
+    @cached(namespace="geocode", key_func_name="geocode-place")
+    def locate(self, location: str) -> Dict[str, Any]:
+        """Raw Nominatim place (display_name, lat, lon ...), empty if not found."""
         location = self._tool.geocode(location, country_codes="es", exactly_one=True)
-        if location:
-            return str(location)
-        else:
-            return "NOT FOUND"
+        # not found is cached too
+        return location.raw if location else {}
@@ -0,0 +1,124 @@
+"""Compact observations of the tools.
+
+The raw responses of the search, maps and page QA services are cached as they
+come (handy when debugging a run); only the fields the agent uses are projected
+into these models, which is what goes into the memory of the run.
+"""
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain.pydantic_v1 import BaseModel
+
+from src.tools import NOT_FOUND
+
+# longer snippets rarely add anything the agent uses
+MAX_SNIPPET_CHARS = 200
+
+_ADDRESS_ATTRIBUTE = re.compile(r"direcci|address|ubicaci|location", re.IGNORECASE)
+_PHONE_ATTRIBUTE = re.compile(r"tel[eé]fono|phone", re.IGNORECASE)
+_HOURS_ATTRIBUTE = re.compile(r"horario|hours", re.IGNORECASE)
+
+
+def shorten(text: Optional[str], max_chars: int = MAX_SNIPPET_CHARS) -> Optional[str]:
+    if not text:
+        return None
+    text = " ".join(str(text).split())
+    return text if len(text) <= max_chars else text[:max_chars - 1].rstrip() + "…"
+
+
+def _legacy(response: Any) -> Any:
+    # entries cached before the observations hold the projected result, encoded as JSON
+    if isinstance(response, str):
+        try:
+            return json.loads(response)
+        except json.JSONDecodeError:
+            return None
+    return response
+
+
+def _attribute(attributes: Dict[str, Any], pattern: re.Pattern) -> Optional[str]:
+    return next((str(value) for name, value in attributes.items() if pattern.search(name)), None)
+
+
+class Observation(BaseModel):
+    def compact(self) -> str:
+        """JSON without empty fields nor whitespace."""
+        return json.dumps(self.dict(exclude_none=True), ensure_ascii=False, separators=(",", ":"))
+
+
+class SearchResult(BaseModel):
+    title: str
+    url: Optional[str] = None
+    snippet: Optional[str] = None
+    date: Optional[str] = None
+
+
+class SearchObservation(Observation):
+    answer: Optional[str] = None
+    results: List[SearchResult] = []
+
+    @classmethod
+    def from_serper(cls, response: Any, top_k: int = 3) -> "SearchObservation":
+        response = _legacy(response)
+        if isinstance(response, list):
+            observation = cls(results=[SearchResult(title=item["title"], url=item.get("url"), snippet=shorten(item.get("description")))
+                                       for item in response if item.get("title")])
+        elif isinstance(response, dict):
+            answer_box = response.get("answerBox", {})
+            observation = cls(answer=shorten(answer_box.get("answer") or answer_box.get("snippet")),
+                              results=[SearchResult(title=item.get("title", ""), url=item.get("link"),
+                                                    snippet=shorten(item.get("snippet")), date=item.get("date"))
+                                       for item in response.get("organic", [])[:top_k]])
+        else:
+            observation = cls()
+        if observation.answer is None and not observation.results:
+            observation.answer = NOT_FOUND
+        return observation
+
+
+class LocationObservation(Observation):
+    name: Optional[str] = None
+    kind: Optional[str] = None
+    address: Optional[str] = None
+    coordinates: Optional[Tuple[float, float]] = None
+    phone: Optional[str] = None
+    hours: Optional[str] = None
+    website: Optional[str] = None
+    description: Optional[str] = None
+
+    @classmethod
+    def from_serper(cls, response: Any) -> Optional["LocationObservation"]:
+        """Location in the knowledge graph or answer box of a search; None if there is neither."""
+        response = _legacy(response)
+        if not isinstance(response, dict):
+            return None
+        graph = response.get("knowledgeGraph")
+        if isinstance(response.get("address"), (dict, str)):
+            # old entries hold {"address": <knowledge graph or answer>}
+            graph = response["address"] if isinstance(response["address"], dict) else {"address": response["address"]}
+        answer = response.get("answerBox", {}).get("answer")
+        if not graph and not answer:
+            return None
+        graph = graph or {}
+        attributes = graph.get("attributes", {})
+        return cls(name=graph.get("title"), kind=graph.get("type"),
+                   address=answer or graph.get("address") or _attribute(attributes, _ADDRESS_ATTRIBUTE),
+                   phone=graph.get("phone") or _attribute(attributes, _PHONE_ATTRIBUTE),
+                   hours=_attribute(attributes, _HOURS_ATTRIBUTE),
+                   website=graph.get("website"), description=shorten(graph.get("description")))
+
+    @classmethod
+    def from_nominatim(cls, name: str, place: Dict[str, Any]) -> "LocationObservation":
+        return cls(name=name, address=place.get("display_name"), coordinates=(float(place["lat"]), float(place["lon"])))
+
+
+class PageAnswer(Observation):
+    answer: Optional[str] = None
+    error: Optional[str] = None
+
+    @classmethod
+    def from_chain(cls, output: Any) -> "PageAnswer":
+        if isinstance(output, dict):
+            return cls(answer=str(output.get("output_text", "")).strip())
+        return cls(error=str(output))
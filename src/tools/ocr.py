@@ -1,32 +1,41 @@
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 
-import numpy as np
 from azure.ai.formrecognizer import AnalysisFeature
 from langchain.tools.azure_cognitive_services import AzureCogsFormRecognizerTool
 from langchain.tools.azure_cognitive_services.utils import detect_file_src_type
 
+from loguru import logger
+
+from src.tools.layout import LayoutBlock, analyze_layout, format_blocks
+from src.tools.ocr_engines import OcrEngine, OcrResult
 from src.utils import cached
 
 
 class OcrTool(AzureCogsFormRecognizerTool):
     name: str = "ocr"
-    result: Optional[Any] = None
     enable_tables: bool = False
     enable_keyvalue: bool = False
     enable_barcode: bool = True
     description: str = "OCR tool using Azure Cognitive Services Form Recognizer"
     image : Optional[str] = None
+    # local engine tried first; Azure is only called when its result is not good enough
+    local_engine: Optional[OcrEngine] = None
+    min_confidence: float = 0.8
+    min_coverage: float = 0.9
+    min_chars: int = 20
+    # seconds to wait for the Form Recognizer poller
+    timeout: float = 60
     _model_id = "prebuilt-read"
 
     def _format_document_analysis_result(self, document_analysis_result: Dict) -> str:
         formatted_result = []
         if document_analysis_result.content is not None:
-            full_content = f"{document_analysis_result.content.replace(':barcode:', '').strip()}"
-
-            bboxes = self._build_bboxes(self.result)
-            content = max(bboxes, key=lambda x: x['density'])['content']
-            full_content = full_content.replace(content, f"*{content}*")
-            formatted_result.append(full_content)
+            blocks = self.layout(document_analysis_result)
+            if blocks:
+                full_content = format_blocks(document_analysis_result.content, blocks)
+            else:
+                full_content = document_analysis_result.content
+            formatted_result.append(full_content.replace(':barcode:', '').strip())
 
         if self.enable_tables and document_analysis_result.tables is not None:
             for i, table in enumerate(document_analysis_result.tables):
@@ -57,30 +66,34 @@ class OcrTool(AzureCogsFormRecognizerTool):
         else:
             raise ValueError(f"Invalid document path: {document_path}")
 
-        self.result = poller.result()
-        return self.result
-
-    def _build_bboxes(self, result):
-        bboxes = []
-        for paragraph in result.paragraphs:
-            for bounding_region in paragraph.bounding_regions:
-                points = np.array([[pol.x, pol.y] for pol in bounding_region.polygon])
-                x_min=np.min(points[:,0])
-                x_max=np.max(points[:,0])
-                y_min=np.min(points[:,1])
-                y_max=np.max(points[:,1])
-                rect = {'x': x_min, 'y': y_min,
-                        'w': x_max-x_min, 'h': y_max-y_min,
-                        'content': paragraph.content,
-                        'density': (x_max-x_min)*(y_max-y_min)/len(paragraph.content)}
-                bboxes.append(rect)
-                # ic(rect)
-        return bboxes
-
-    @cached(key_func_name="ocr")
+        # keep the result local to this call; the tool is shared across runs
+        return poller.result(timeout=self.timeout)
+
+    def layout(self, document_analysis_result: Any) -> List[LayoutBlock]:
+        """Paragraph blocks in reading order, with headline candidates ranked."""
+        return analyze_layout(document_analysis_result)
+
+    def _local_analysis(self, document_path: str) -> Optional[OcrResult]:
+        if self.local_engine is None or detect_file_src_type(document_path) != "local":
+            return None
+        result = self.local_engine.analyze(document_path)
+        if result is None:
+            return None
+        if result.confidence < self.min_confidence or result.coverage < self.min_coverage or result.chars < self.min_chars:
+            logger.info(f"Escalating OCR to {self._model_id}: {self.local_engine.name} confidence={result.confidence:.2f} "
+                        f"coverage={result.coverage:.2f} chars={result.chars}")
+            return None
+        logger.info(f"Using {self.local_engine.name} OCR: confidence={result.confidence:.2f} coverage={result.coverage:.2f}")
+        return result
+
+    @cached(namespace="ocr")
     def _run(self, url: str) -> str:
         """Use the tool."""
         try:
+            local_result = self._local_analysis(url)
+            if local_result is not None:
+                return self._format_document_analysis_result(local_result.result)
+
             document_analysis_result = self._document_analysis(url)
             if not document_analysis_result:
                 return "No good document analysis result was found"
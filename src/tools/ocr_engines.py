@@ -0,0 +1,134 @@
+import shutil
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+
+try:
+    import pytesseract
+    from PIL import Image
+except ImportError:  # optional dependencies, the local engine is disabled without them
+    pytesseract = None
+
+# The classes below mirror the attributes of the Form Recognizer AnalyzeResult
+# used by OcrTool, so that local results are formatted in the very same way.
+
+@dataclass
+class Point:
+    x: float
+    y: float
+
+@dataclass
+class Span:
+    offset: int
+    length: int
+
+@dataclass
+class BoundingRegion:
+    page_number: int
+    polygon: List[Point]
+
+@dataclass
+class Paragraph:
+    content: str
+    spans: List[Span]
+    bounding_regions: List[BoundingRegion]
+
+@dataclass
+class Page:
+    page_number: int
+    barcodes: List = field(default_factory=list)
+
+@dataclass
+class AnalyzeResult:
+    content: str
+    paragraphs: List[Paragraph]
+    pages: List[Page]
+    tables: Optional[List] = None
+    key_value_pairs: Optional[List] = None
+
+
+@dataclass
+class OcrResult:
+    result: AnalyzeResult
+    # mean word confidence, weighted by word length (0..1)
+    confidence: float
+    # share of the detected words read with a minimum confidence (0..1)
+    coverage: float
+
+    @property
+    def chars(self) -> int:
+        return len(self.result.content.strip())
+
+
+class OcrEngine(ABC):
+    """Local OCR engine, tried before the remote Form Recognizer service."""
+
+    name: str = "engine"
+
+    @abstractmethod
+    def analyze(self, document_path: str) -> Optional[OcrResult]:
+        """Analyze a local image; return None if the engine could not read it."""
+
+
+class TesseractEngine(OcrEngine):
+    name = "tesseract"
+
+    def __init__(self, lang: str = "spa+eng", min_word_confidence: float = 0.5):
+        if not self.is_available():
+            raise RuntimeError("pytesseract and the tesseract binary are required by TesseractEngine")
+        self.lang = lang
+        self.min_word_confidence = min_word_confidence
+
+    @staticmethod
+    def is_available() -> bool:
+        return pytesseract is not None and shutil.which("tesseract") is not None
+
+    def analyze(self, document_path: str) -> Optional[OcrResult]:
+        try:
+            with Image.open(document_path) as image:
+                data = pytesseract.image_to_data(image, lang=self.lang, output_type=pytesseract.Output.DICT)
+        except Exception as ex:
+            logger.warning(f"Tesseract could not read {document_path}: {ex}")
+            return None
+        return self._build_result(data)
+
+    def _build_result(self, data: Dict[str, List]) -> OcrResult:
+        # group the words by paragraph, and the words of a paragraph by line
+        paragraphs: Dict[Tuple[int, int, int], Dict[int, List[int]]] = {}
+        detected = readable = 0
+        weighted_confidence = weights = 0.0
+        for i, text in enumerate(data["text"]):
+            confidence = float(data["conf"][i])
+            if confidence < 0 or not text.strip():
+                continue
+            confidence /= 100
+            detected += 1
+            readable += confidence >= self.min_word_confidence
+            weighted_confidence += confidence * len(text)
+            weights += len(text)
+            key = (data["page_num"][i], data["block_num"][i], data["par_num"][i])
+            paragraphs.setdefault(key, {}).setdefault(data["line_num"][i], []).append(i)
+
+        content = ""
+        result_paragraphs = []
+        for (page, _, _), lines in paragraphs.items():
+            words = [i for line in lines.values() for i in line]
+            text = "\n".join(" ".join(data["text"][i].strip() for i in line) for line in lines.values())
+            x_min = min(data["left"][i] for i in words)
+            y_min = min(data["top"][i] for i in words)
+            x_max = max(data["left"][i] + data["width"][i] for i in words)
+            y_max = max(data["top"][i] + data["height"][i] for i in words)
+            if content:
+                content += "\n"
+            polygon = [Point(x_min, y_min), Point(x_max, y_min), Point(x_max, y_max), Point(x_min, y_max)]
+            result_paragraphs.append(Paragraph(content=text,
+                                               spans=[Span(len(content), len(text))],
+                                               bounding_regions=[BoundingRegion(page, polygon)]))
+            content += text
+
+        pages = [Page(page_number) for page_number in sorted(set(data["page_num"]))]
+        return OcrResult(result=AnalyzeResult(content=content, paragraphs=result_paragraphs, pages=pages),
+                         confidence=weighted_confidence / weights if weights else 0.,
+                         coverage=readable / detected if detected else 0.)
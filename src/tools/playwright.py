@@ -1,35 +1,132 @@
 import json
+import subprocess
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+from uuid import uuid4
 
 from langchain.tools import BaseTool
-from langchain.tools.shell.tool import ShellTool
+from loguru import logger
 
-from src.tools.scraper import scrape
+from src.cache.namespaces import get_namespace
+from src.tools.scraper import extract_main_content, parse_json_ld, scrape, strip_lines
 from src.utils import cached
 
+ERROR_PAGE = {"title": "ERROR", "body": ""}
+
+
+class PageLoadError(RuntimeError):
+    """The page could not be loaded; raised so that the failure is not cached."""
+
 
 class Playwright(BaseTool):
     name = "playwright"
     description = "recommended for web scraping"
-    tool : Optional[ShellTool]
-    command: Optional[str]
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.tool = ShellTool()
+    # seconds given to the page to load; the container is killed shortly after
+    timeout: int = 45
+    # keep only the main content of the page (and its structured event data) instead of the whole text
+    main_content: bool = True
+    # "html" captures the page source, "text" the rendered text (and the JSON-LD blocks) of the page
+    capture: str = "html"
+    # bytes of content read from the page, larger pages are truncated
+    max_bytes: int = 2 * 1024 * 1024
+
+    def _command(self, url: str, container: str) -> List[str]:
         playw_path = Path(__file__).parent.parent.parent.absolute()
-        self.command = f"docker run -v {playw_path}:/mnt/playw --rm --ipc=host --user pwuser --security-opt seccomp={playw_path / 'seccomp_profile.json'} mcr.microsoft.com/playwright:latest node /mnt/playw/app.js {{url}}"
+        return ["timeout", "--kill-after=5", str(self.timeout + 15),
+                "docker", "run", "--name", container, "-v", f"{playw_path}:/mnt/playw", "--rm", "--ipc=host", "--user", "pwuser",
+                "--security-opt", f"seccomp={playw_path / 'seccomp_profile.json'}",
+                "mcr.microsoft.com/playwright:latest", "node", "/mnt/playw/app.js",
+                url, str(self.timeout * 1000), str(self.max_bytes), self.capture]
 
-    @cached(key_func_name="playwright")
     def _run(self, url: str) -> str:
         """Run query through Playwright and return json string containing page title and body."""
-        page = self.tool.run({"commands": [self.command.format(url=url)]})
-        return self._scrape(page)
+        try:
+            return self._fetch(url, self.main_content, self.capture)
+        except PageLoadError as ex:
+            logger.warning(str(ex))
+            return json.dumps(ERROR_PAGE)
+
+    @cached(namespace="playwright")
+    def _fetch(self, url: str, main_content: bool, capture: str) -> str:
+        return self._scrape(self._capture(url), url, main_content)
+
+    def _capture(self, url: str) -> Dict[str, Any]:
+        """Read the records streamed by app.js, stopping (and killing the container) once `max_bytes` are read."""
+        page: Optional[Dict[str, Any]] = None
+        chunks, size = [], 0
+        container = f"playwright-{uuid4().hex[:12]}"
+        process = subprocess.Popen(self._command(url, container), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        try:
+            for line in process.stdout:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record["type"] == "meta":
+                    page = {"title": record["title"], "url": record["url"], "capture": record["capture"], "truncated": False}
+                elif record["type"] == "jsonld" and page is not None:
+                    page["jsonld"] = record["data"]
+                elif record["type"] == "chunk" and page is not None:
+                    data = record["data"][:self.max_bytes - size]
+                    chunks.append(data)
+                    size += len(data)
+                    if size >= self.max_bytes:
+                        page["truncated"] = True
+                        break
+                elif record["type"] == "end" and page is not None:
+                    page["truncated"] = page["truncated"] or record["truncated"]
+                    break
+                elif record["type"] == "error":
+                    raise PageLoadError(f"playwright error loading {url}: {record['message']}")
+        finally:
+            running = process.poll() is None
+            process.kill()
+            process.wait()
+            if running:
+                # killing the docker client (and its timeout wrapper) leaves the container running
+                self._kill_container(container)
+        if page is None:
+            raise PageLoadError(f"playwright could not load {url}")
+        if page["truncated"]:
+            logger.info(f"playwright page {url} truncated to {size} characters")
+        page["body"] = "".join(chunks)
+        return page
+
+    @staticmethod
+    def _kill_container(container: str) -> None:
+        try:
+            subprocess.run(["docker", "kill", container], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=15)
+        except (OSError, subprocess.TimeoutExpired) as ex:
+            logger.warning(f"could not kill container {container}: {ex}")
+
+    def _scrape(self, page: Dict[str, Any], url: str, main_content: bool) -> str:
+        jsonld = page.pop("jsonld", [])
+        if page["capture"] == "text":
+            # the rendered text has no markup left to score
+            page["body"] = strip_lines(page["body"])
+            events = parse_json_ld(jsonld)
+            if events:
+                page["events"] = events
+            return json.dumps(page, ensure_ascii=False)
+        if not main_content:
+            page["body"] = scrape(page["body"], exclude_tags=["head", "script", "style", "cdata", "footer"])
+            return json.dumps(page, ensure_ascii=False)
+
+        # the container of the main content is learned on the first page of a site, and tried first on the next ones
+        domain = urlparse(url).hostname or ""
+        rules = get_namespace("extraction_rules")
+        key = f"domain-{domain}"
+        rule = rules.get(key)
+        body, selector, events = extract_main_content(page["body"], rule)
+        if selector and selector != rule:
+            logger.info(f"learned main content selector for {domain}: {selector}")
+            rules.set(key, f"https://{domain}/", selector)
+        if events:
+            page["events"] = events
+        page["body"] = body
+        return json.dumps(page, ensure_ascii=False)
 
-    def _scrape(self, content: str) -> str:
-        page = json.loads(content)
-        page["body"] = scrape(page["body"])
-        return json.dumps(page)
     async def _arun(self, url: str) -> str:
         """Use the tool asynchronously."""
-        raise NotImplementedError("Playwright does not support async")    
\ No newline at end of file
+        raise NotImplementedError("Playwright does not support async")
@@ -1,3 +1,7 @@
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
 from bs4 import BeautifulSoup, Comment
 
 # based on https://github.com/trancethehuman/entities-extraction-web-scraper/blob/main/scrape.py
@@ -36,3 +40,174 @@ def scrape(html: str, exclude_tags: list[str] = ["script", "style", "cdata", "fo
     results_formatted = strip_lines(results)
 
     return results_formatted
+
+
+# Main content extraction, readability style: text blocks score their ancestors,
+# and the best scored container (penalized by its link density) is the main content.
+
+POSITIVE_HINTS = re.compile(r"article|body|content|entry|event|main|page|post|text|detail|info|descrip", re.IGNORECASE)
+NEGATIVE_HINTS = re.compile(r"banner|combx|comment|cookie|consent|footer|header|menu|modal|nav|newsletter|popup|related|share|sidebar|social|sponsor|widget|breadcrumb", re.IGNORECASE)
+BOILERPLATE_TAGS = ["head", "script", "style", "noscript", "cdata", "nav", "aside", "iframe", "svg"]
+# boilerplate only at page level; inside an article the header holds its title, date and venue
+PAGE_BOILERPLATE_TAGS = ["header", "footer", "form"]
+ARTICLE_TAGS = ["article", "main"]
+BLOCK_TAGS = ["p", "li", "td", "pre", "h1", "h2", "h3", "h4", "h5", "dd", "span", "time", "address"]
+CONTAINER_TAGS = {"div", "article", "main", "section", "td", "ul", "ol", "body"}
+# minimum number of characters of the main content, otherwise the whole page is used
+MIN_CONTENT_CHARS = 200
+EVENT_TYPES = re.compile(r"Event$|Festival$")
+
+
+def _class_weight(element) -> int:
+    weight = 0
+    for hint in (" ".join(element.get("class", [])), element.get("id", "")):
+        if hint and POSITIVE_HINTS.search(hint):
+            weight += 25
+        if hint and NEGATIVE_HINTS.search(hint):
+            weight -= 25
+    return weight
+
+
+def _link_density(element) -> float:
+    text_length = len(element.get_text(" ", strip=True)) or 1
+    link_length = sum(len(link.get_text(" ", strip=True)) for link in element.find_all("a"))
+    return link_length / text_length
+
+
+def _score_candidates(soup) -> Dict[Any, float]:
+    scores: Dict[Any, float] = {}
+    for block in soup.find_all(BLOCK_TAGS):
+        text = block.get_text(" ", strip=True)
+        if len(text) < 25:
+            continue
+        score = 1 + text.count(",") + min(len(text) / 100, 3)
+        for level, ancestor in enumerate(block.parents):
+            if level > 2 or ancestor.name is None:
+                break
+            if ancestor.name not in CONTAINER_TAGS:
+                continue
+            if ancestor not in scores:
+                scores[ancestor] = _class_weight(ancestor)
+            scores[ancestor] += score / (level + 1)
+    return {element: score * (1 - _link_density(element)) for element, score in scores.items()}
+
+
+def _selector(element) -> str:
+    """CSS path of an element, stable across the pages of the same template."""
+    parts = []
+    while element is not None and element.name not in (None, "[document]", "html"):
+        if element.get("id"):
+            parts.append(f'{element.name}[id="{element["id"]}"]')
+            break
+        position = 1 + sum(1 for sibling in element.find_previous_siblings(element.name))
+        parts.append(f"{element.name}:nth-of-type({position})")
+        element = element.parent
+    return " > ".join(reversed(parts))
+
+
+def extract_structured_events(soup) -> List[Dict[str, Any]]:
+    """Compact schema.org Event items found in the JSON-LD blocks of the page."""
+    return parse_json_ld([script.string or "" for script in soup.find_all("script", attrs={"type": "application/ld+json"})])
+
+
+def parse_json_ld(blocks: List[str]) -> List[Dict[str, Any]]:
+    """Compact schema.org Event items of raw JSON-LD blocks."""
+    events = []
+
+    def visit(item):
+        if isinstance(item, list):
+            for child in item:
+                visit(child)
+        elif isinstance(item, dict):
+            types = item.get("@type", [])
+            types = types if isinstance(types, list) else [types]
+            if any(EVENT_TYPES.search(str(type_)) for type_ in types):
+                events.append(_compact_event(item))
+            else:
+                visit(item.get("@graph", []))
+
+    for block in blocks:
+        try:
+            visit(json.loads(block))
+        except json.JSONDecodeError:
+            continue
+    return events
+
+
+def _compact_event(item: Dict[str, Any]) -> Dict[str, Any]:
+    def name_of(value):
+        if isinstance(value, list):
+            return [name_of(v) for v in value]
+        return value.get("name") if isinstance(value, dict) else value
+
+    location = item.get("location")
+    location = location[0] if isinstance(location, list) and location else location
+    if isinstance(location, dict):
+        address = location.get("address")
+        if isinstance(address, dict):
+            address = ", ".join(str(address[key]) for key in ("streetAddress", "postalCode", "addressLocality", "addressRegion", "addressCountry")
+                                if address.get(key) and not isinstance(address[key], dict))
+        location = {"name": location.get("name"), "address": address}
+    offers = item.get("offers")
+    offers = offers[0] if isinstance(offers, list) and offers else offers
+    if isinstance(offers, dict):
+        offers = {key: offers.get(key) for key in ("price", "lowPrice", "priceCurrency", "url", "availability") if offers.get(key)}
+    event = {"type": item.get("@type"),
+             "name": item.get("name"),
+             "startDate": item.get("startDate"),
+             "endDate": item.get("endDate"),
+             "doorTime": item.get("doorTime"),
+             "location": location,
+             "performer": name_of(item.get("performer")),
+             "organizer": name_of(item.get("organizer")),
+             "offers": offers,
+             "url": item.get("url"),
+             "description": (item.get("description") or "")[:500] or None}
+    return {key: value for key, value in event.items() if value}
+
+
+def extract_main_content(html: str, selector: Optional[str] = None) -> Tuple[str, Optional[str], List[Dict[str, Any]]]:
+    """Main text of a page, the selector of its container and the structured events of the page.
+
+    If a `selector` learned on a previous page of the same site is given, and it
+    still yields enough text, scoring is skipped.
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    events = extract_structured_events(soup)
+
+    for element in soup.find_all(BOILERPLATE_TAGS):
+        element.decompose()
+    for element in soup.find_all(PAGE_BOILERPLATE_TAGS):
+        if element.attrs is not None and element.find_parent(ARTICLE_TAGS) is None:
+            element.decompose()
+    for comment in soup.find_all(string=lambda text: isinstance(text, Comment)):
+        comment.extract()
+    for element in soup.find_all(True):
+        if element.attrs is None:
+            # inside an element removed before
+            continue
+        hint = " ".join(element.get("class", [])) + " " + element.get("id", "")
+        if NEGATIVE_HINTS.search(hint) and not POSITIVE_HINTS.search(hint):
+            element.decompose()
+
+    main = None
+    if selector:
+        try:
+            main = soup.select_one(selector)
+        except Exception:
+            main = None
+        if main is not None and len(main.get_text(" ", strip=True)) < MIN_CONTENT_CHARS:
+            main = None
+    if main is None:
+        scores = _score_candidates(soup)
+        if scores:
+            main = max(scores, key=scores.get)
+            if main.parent is not None and main.parent.name in ARTICLE_TAGS and _link_density(main.parent) < 0.5:
+                # the article also holds the header (title, date, venue) of the description
+                main = main.parent
+            if len(main.get_text(" ", strip=True)) < MIN_CONTENT_CHARS:
+                main = None
+        selector = _selector(main) if main is not None else None
+
+    content = strip_lines((main or soup).get_text(separator="\n"))
+    return content, selector, events
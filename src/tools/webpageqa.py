@@ -1,14 +1,18 @@
 import json
-from typing import Optional, Type
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Type
 
+from langchain.chains.base import Chain
 from langchain.chains.qa_with_sources.loading import BaseCombineDocumentsChain
 from langchain.docstore.document import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.tools import BaseTool, StructuredTool
+from loguru import logger
 from pydantic import BaseModel, Field
 
-from src.tools.playwright import Playwright
-from src.utils import DEFAULT_CACHE, cached, try_loads
+from src.tools.observations import PageAnswer
+from src.tools.playwright import PageLoadError, Playwright
+from src.utils import cached, try_loads
 
 # Code based on https://python.langchain.com/en/latest/use_cases/autonomous_agents/marathon_times.html
 
@@ -32,28 +36,88 @@ class WebpageQA(StructuredTool):
     text_splitter: RecursiveCharacterTextSplitter = Field(default_factory=_get_text_splitter)
     tool = Optional[Playwright]
     qa_chain: Optional[BaseCombineDocumentsChain]
+    # map-reduce mode, used when the page is split in several chunks
+    map_chain: Optional[Chain] = None
+    reduce_chain: Optional[Chain] = None
+    # chunks questioned at the same time (shared by all the runs using the tool)
+    max_concurrency: int = 4
+    executor: Optional[Any] = None
     args_schema: Type[RunArgsSchema] = RunArgsSchema
 
     def __init__(self, qa_chain: BaseCombineDocumentsChain, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.qa_chain = qa_chain
         self.tool = Playwright()
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="webpageqa")
 
-    @cached(DEFAULT_CACHE, key_func_name="webpageqa")
     def _run(self, url: str, query_context:str, query: str) -> str:
         """Useful for browsing websites and scraping the text information."""
-        playw_result = self.tool.run(url)
         try:
-            result = try_loads(playw_result.strip("'").strip('"')) or try_loads(try_loads(playw_result))
-        except Exception as ex:
-            print (f"error inspecting {url} with query {query} and query_context {query_context}")
-            return "Error loading page"
-        if result["title"] == "ERROR" and result["body"] == "":
-            return "Error loading page"
+            return PageAnswer.from_chain(self._answer(url, query_context, query)).compact()
+        except PageLoadError:
+            logger.warning(f"error inspecting {url} with query {query} and query_context {query_context}")
+            return PageAnswer(error="Error loading page").compact()
+
+    @cached(namespace="webpageqa")
+    def _answer(self, url: str, query_context:str, query: str) -> Any:
+        """Raw output of the QA chain (kept whole in the cache)."""
+        result = try_loads(self.tool.run(url))
+        if not isinstance(result, dict) or (result["title"] == "ERROR" and result["body"] == ""):
+            # not cached, the page may load next time
+            raise PageLoadError(f"could not load {url}")
         docs = [Document(page_content=result["body"], metadata={"source": url, "title": result["title"]} )]
+        if result.get("events"):
+            # structured event data of the page goes first, it usually answers most of the questions
+            docs.insert(0, Document(page_content=json.dumps(result["events"], ensure_ascii=False), metadata={"source": url, "title": result["title"]}))
         chunks = self.text_splitter.split_documents(docs)
+        question = f"{query} \nOnly consider information related to this event: {query_context}"
+
+        if self.map_chain is None or len(chunks) == 1:
+            return self.qa_chain({"input_documents": chunks, "question": question}, return_only_outputs=True)
+        return {"output_text": self._map_reduce(chunks, question)}
+
+    def _map_reduce(self, chunks: List[Document], question: str) -> str:
+        """Question the chunks in parallel, stopping as soon as all the requested attributes are answered."""
+        pending = {self.executor.submit(self.map_chain.run, context=chunk.page_content, question=question): index
+                   for index, chunk in enumerate(chunks)}
+        answers: Dict[int, Any] = {}
+        requested = set()
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = pending.pop(future)
+                    try:
+                        answers[index] = future.result()
+                    except Exception as ex:
+                        logger.warning(f"webpageqa chunk {index} failed: {ex}")
+                        continue
+                    requested.update(name.lower() for name in answers[index].requested)
+                found = {answer.name.lower() for chunk_answer in answers.values() for answer in chunk_answer.answers}
+                if requested and requested <= found:
+                    logger.info(f"webpageqa answered with {len(answers)} of {len(chunks)} chunks")
+                    break
+        finally:
+            # chunk calls already running can't be interrupted, their answers are ignored
+            for future in pending:
+                future.cancel()
+
+        return self._reduce([answers[index] for index in sorted(answers)], question)
 
-        return self.qa_chain({"input_documents": chunks, "question": f"{query} \nOnly consider information related to this event: {query_context}"}, return_only_outputs=True)
+    def _reduce(self, answers: List[Any], question: str) -> str:
+        values: Dict[str, List[str]] = {}
+        for chunk_answer in answers:
+            for answer in chunk_answer.answers:
+                attribute_values = values.setdefault(answer.name.lower(), [])
+                if answer.value not in attribute_values:
+                    attribute_values.append(answer.value)
+        if not values:
+            return "I don't know"
+        lines = "\n".join(f"{name}: {' | '.join(attribute_values)}" for name, attribute_values in values.items())
+        if self.reduce_chain is None or all(len(attribute_values) == 1 for attribute_values in values.values()):
+            # the chunks agree, nothing to combine
+            return lines
+        return self.reduce_chain.run(answers=lines, question=question)
     
     async def _arun(self, url: str, question: str) -> str:
         raise NotImplementedError
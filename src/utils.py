@@ -1,71 +1,158 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
 from functools import wraps
 import hashlib
 from pathlib import Path
-import duckdb
 import json
+import re
 import inspect
-from typing import Dict, Optional
+import threading
+from typing import Dict, List, Optional, Tuple
 
-DEFAULT_CACHE = Path(Path(__file__).absolute().parent.parent / "data" / "cache.ndjson")
+from src.cache.keys import canonical_arguments
+from src.cache.namespaces import get_fuzzy_index, get_namespace, get_policy
+from src.cache.store import DEFAULT_CACHE, NdjsonStore
 
-def get_key_from_function(func_name, func, args, kwargs):
-    # Generate the cache key from the function's arguments.
-    # func_name = key_func_name or func.__name__
-    # TODO: nicer way to get the arguments
-    arguments = list(kwargs.values())
-    if len(arguments) == 0:
-        arguments = list(map(str, args if not "self" in inspect.signature(func).parameters.keys() else args[1:]))
-    key_parts = [func_name] + arguments # list(kwargs.values()) # list(map(str, args if not "self" in inspect.signature(func).parameters.keys() else args[1:]))´
-    arguments = '-'.join(key_parts)
-    return arguments
+ICALENDAR_COMPONENT = re.compile(r"BEGIN:(VEVENT|VTIMEZONE)\b.*?END:\1", re.DOTALL)
 
-def retrieve_by_key(key: str, cache_file: Path = DEFAULT_CACHE):
-    conn = duckdb.connect()
-    select_script = """SELECT value
-    FROM read_ndjson_auto('{cache_file}')
-    WHERE key = '{key}'
-    """
+# one store per cache file, shared by all the tools (and threads) using it
+_STORES: Dict[Path, NdjsonStore] = {}
+_STORES_LOCK = threading.Lock()
+# locks of the cache keys being computed, with the number of threads using them
+_INFLIGHT: Dict[str, Tuple[threading.Lock, int]] = {}
+_INFLIGHT_LOCK = threading.Lock()
+# cache lookups of the current tool call, as (namespace, hit) pairs; see `track_cache`
+_CACHE_LOOKUPS: ContextVar[Optional[List[Tuple[str, bool]]]] = ContextVar("cache_lookups", default=None)
 
-    if cache_file.exists() and cache_file.stat().st_size > 0:
-        result = conn.execute(select_script.format(cache_file=cache_file, key=key)).fetchall()
-        if len(result) == 0:
-            return None
-        return result[0][0]
-    else:
-        return None
+def get_key_from_function(func_name, func, args, kwargs, normalize: bool = False) -> str:
+    """Canonical encoding of the call arguments (`self` excluded), used to build the cache key."""
+    bound = inspect.signature(func).bind(*args, **kwargs)
+    bound.apply_defaults()
+    arguments = [value for name, value in bound.arguments.items() if name != "self"]
+    return canonical_arguments(func_name, arguments, normalize)
+
+def get_store(cache_file: Path = DEFAULT_CACHE) -> NdjsonStore:
+    with _STORES_LOCK:
+        if cache_file not in _STORES:
+            _STORES[cache_file] = NdjsonStore(cache_file)
+        return _STORES[cache_file]
+
+def retrieve_by_key(key: str, cache_file: Path = DEFAULT_CACHE):
+    return get_store(cache_file).get(key)
 
 def save(key: str, arguments: str, value: any, cache_file: Path = DEFAULT_CACHE):
-    with open(cache_file, "a")  as file:
-        file.write(json.dumps({"key": key, "arguments": arguments, "value": value})+"\n")
+    get_store(cache_file).set(key, arguments, value)
 
-def cached(cache_file: Path = DEFAULT_CACHE, key_func_name: str = None):
+@contextmanager
+def _inflight_lock(key: str):
+    with _INFLIGHT_LOCK:
+        lock, waiters = _INFLIGHT.get(key, (threading.Lock(), 0))
+        _INFLIGHT[key] = (lock, waiters + 1)
+    try:
+        with lock:
+            yield
+    finally:
+        with _INFLIGHT_LOCK:
+            lock, waiters = _INFLIGHT[key]
+            if waiters == 1:
+                del _INFLIGHT[key]
+            else:
+                _INFLIGHT[key] = (lock, waiters - 1)
+
+@contextmanager
+def track_cache():
+    """Collect the (namespace, hit) pairs of the cached calls made in this thread within the block."""
+    lookups: List[Tuple[str, bool]] = []
+    token = _CACHE_LOOKUPS.set(lookups)
+    try:
+        yield lookups
+    finally:
+        _CACHE_LOOKUPS.reset(token)
+
+def _track_lookup(name: str, hit: bool) -> None:
+    lookups = _CACHE_LOOKUPS.get()
+    if lookups is not None:
+        lookups.append((name, hit))
+
+def cached(cache_file: Optional[Path] = None, key_func_name: str = None, namespace: str = None):
     """
     Decorator that caches the results of the function call.
+    Values are stored in the given namespace (by default `key_func_name` or the
+    function name), whose policy sets their TTL, size limit, location and key
+    normalization; pass `cache_file` to use a plain store instead.
     """
-    if not cache_file.exists():
-        cache_file.touch()
 
     def decorator_cached(func):
+        func_name = key_func_name or namespace or func.__name__
+
         @wraps(func)
         def wrapper(*args, **kwargs):
+            policy = None if cache_file else get_policy(namespace or func_name)
+            store = get_store(cache_file) if cache_file else get_namespace(policy.name)
+            index = get_fuzzy_index(policy.name) if policy else None
             # Generate the cache key from the function's arguments.
-            arguments = get_key_from_function(key_func_name or func.__name__, func, args, kwargs)
+            arguments = get_key_from_function(func_name, func, args, kwargs, normalize=policy is not None and policy.normalize)
             key = hashlib.sha1(arguments.encode()).hexdigest()
-            result = retrieve_by_key(key, cache_file)
+            # the near-duplicate candidate (if any) is looked up together with the key, in a single round trip
+            similar_key = index.lookup(arguments) if index is not None else None
+            if similar_key is not None and similar_key != key:
+                result, similar = store.get_many([key, similar_key])
+                if result is None and similar is not None:
+                    print ("Using similar cached value for key: {}".format(arguments))
+                    _track_lookup(func_name, True)
+                    return similar
+            else:
+                result = store.get(key)
 
             if result is None:
-                # Run the function and cache the result for next time.
-                result = func(*args, **kwargs)
-                save(key, arguments, result, cache_file)
+                # Concurrent calls with the same key (e.g. parallel sub-agents) wait for the first one.
+                with _inflight_lock(key):
+                    result = store.get(key)
+                    _track_lookup(func_name, result is not None)
+                    if result is None:
+                        # Run the function and cache the result for next time.
+                        result = func(*args, **kwargs)
+                        # None reads as a miss, so it isn't cached
+                        if result is not None:
+                            store.set(key, arguments, result)
+                            if index is not None:
+                                index.add(key, arguments)
             else:
                 # Skip the function entirely and use the cached value instead.
                 print ("Using cached value for key: {}".format(arguments))
+                _track_lookup(func_name, True)
 
             return result
         return wrapper
     return decorator_cached
 
 
+def hash_image(image: str) -> str:
+    """Stable key for an image: hash of the file content, or of the url for remote images."""
+    path = Path(image)
+    if path.is_file():
+        digest = hashlib.sha1()
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 16), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+    return hashlib.sha1(image.encode()).hexdigest()
+
+
+def merge_icalendars(calendars: List[str], prodid: str = "-//img2calendar//EN") -> Optional[str]:
+    """Merge the VEVENTs (and VTIMEZONEs) of several iCalendar documents into a single one."""
+    components = []
+    for calendar in calendars:
+        for match in ICALENDAR_COMPONENT.finditer(calendar):
+            component = match.group(0)
+            if component not in components:
+                components.append(component)
+    if not any(component.startswith("BEGIN:VEVENT") for component in components):
+        return None
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", f"PRODID:{prodid}"] + [component.strip() for component in components] + ["END:VCALENDAR"]
+    return "\n".join(lines)
+
+
 def try_loads(text: str, fallback_to_text: bool = False) -> Optional[Dict]:
     try:
         if isinstance(text, str):